@@ -0,0 +1,128 @@
+import os
+import json
+import threading
+from typing import Any, Dict, List, Optional
+
+SOURCE_FILE = "store/attributes.json"
+COMPILED_FILE = "store/attributes.compiled.json"
+
+# Cultures served by the reservation site
+CULTURES = ("en-CA", "fr-CA")
+
+# Function to get localized display name
+def get_localized_display_name(localized_values, culture_name):
+    for value in localized_values:
+        if value['cultureName'] == culture_name:
+            return value['displayName']
+    return None
+
+
+class AttributeDecoder:
+    """
+    Lookup tables for decoding a resource's `definedAttributes`.
+
+    Built once from attributes.json into per-culture dicts
+    (attribute id -> display name, attribute id -> enum value -> display name)
+    and cached in a compact JSON file that is rebuilt when the source changes.
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self, tables: Dict[str, Any]):
+        self.names = {culture: tables['cultures'][culture]['names'] for culture in tables['cultures']}
+        self.values = {culture: tables['cultures'][culture]['values'] for culture in tables['cultures']}
+        self.ranges = tables['ranges']
+        self.source_mtime = tables.get('source_mtime')
+
+    @staticmethod
+    def compile(attribute_data: Dict[str, Any], cultures=CULTURES) -> Dict[str, Any]:
+        """Build the lookup tables from the raw attributes.json payload."""
+        tables = {"cultures": {}, "ranges": {}}
+        for culture in cultures:
+            names, values = {}, {}
+            for attribute_id, details in attribute_data.items():
+                names[attribute_id] = get_localized_display_name(details.get('localizedValues', []), culture)
+                if details.get('values'):
+                    values[attribute_id] = {
+                        str(value['enumValue']): get_localized_display_name(value.get('localizedValues', []), culture)
+                        for value in details['values']
+                    }
+            tables["cultures"][culture] = {"names": names, "values": values}
+
+        for attribute_id, details in attribute_data.items():
+            if not details.get('values'):
+                tables["ranges"][attribute_id] = [details.get('minValue'), details.get('maxValue')]
+        return tables
+
+    @classmethod
+    def load(cls, source: str = SOURCE_FILE, compiled: str = COMPILED_FILE) -> Optional["AttributeDecoder"]:
+        """
+        Shared decoder, read from the compiled cache when it is newer than `source`.
+        Returns None if neither file can be read.
+        """
+        with cls._lock:
+            try:
+                source_mtime = os.path.getmtime(source)
+            except OSError:
+                source_mtime = None
+
+            if cls._instance is not None and cls._instance.source_mtime == source_mtime:
+                return cls._instance
+
+            tables = None
+            try:
+                with open(compiled, "r", encoding="utf-8") as fp:
+                    cached = json.load(fp)
+                if cached.get('source_mtime') == source_mtime:
+                    tables = cached
+            except (OSError, ValueError):
+                pass
+
+            if tables is None:
+                try:
+                    with open(source, "r", encoding="utf-8") as fp:
+                        tables = cls.compile(json.load(fp))
+                except (OSError, ValueError) as e:
+                    print(f"Attribute load error: {e}")
+                    return None
+                tables['source_mtime'] = source_mtime
+                try:
+                    tmp = f"{compiled}.tmp"
+                    with open(tmp, "w", encoding="utf-8") as fp:
+                        json.dump(tables, fp, ensure_ascii=False, separators=(',', ':'))
+                    os.replace(tmp, compiled)
+                except OSError as e:
+                    print(f"Attribute cache write error: {e}")
+
+            cls._instance = cls(tables)
+            return cls._instance
+
+    def decode(self, defined_attributes: List[Dict[str, Any]], culture_name: str = "en-CA") -> List[Dict[str, str]]:
+        """
+        Decode a resource's `definedAttributes` into [{"attribute": name, "value": text}, ...].
+        Unknown attributes and enum values are skipped.
+        """
+        names = self.names[culture_name]
+        values = self.values[culture_name]
+
+        attributes_list = []
+        for attr in defined_attributes:
+            attribute_id = str(attr['attributeDefinitionId'])
+            if attribute_id not in names:
+                continue
+
+            enum_names = values.get(attribute_id)
+            if enum_names is not None:
+                decoded = (enum_names.get(str(i)) for i in attr.get('values', []))
+                attributes_list.append({
+                    "attribute": names[attribute_id],
+                    "value": ', '.join(name for name in decoded if name is not None)
+                })
+            else :
+                min_value, max_value = self.ranges[attribute_id]
+                attributes_list.append({
+                    "attribute": names[attribute_id],
+                    "value": f"[Min : {min_value} - Max : {max_value}]"
+                })
+        return attributes_list
@@ -0,0 +1,476 @@
+"""
+Benchmarks for the scraper's hot paths.
+
+    python bench.py store --rows 2000
+    python bench.py e2e --parks 1 2 --depth 2 3 --sites 8 --days 30 60 --out bench.json
+    python bench.py e2e --compare bench.json
+    python bench.py startup --repeat 5
+
+`e2e` runs the whole pipeline against the synthetic backend of mockserver.py,
+one case per combination of the swept values, each in its own process and
+working directory. It reports wall time, API calls and peak traced memory per
+stage, and writes them as JSON; `--compare` flags stages that got slower.
+
+`startup` times a cold start of the web server in fresh processes: importing
+scraper.py, importing server.py (which creates the Scraper) and answering the
+first request, and lists the slowest imports reported by `python -X importtime`.
+"""
+import os
+import sys
+import statistics
+import time
+import json
+import shutil
+import socket
+import argparse
+import itertools
+import subprocess
+import tempfile
+import tracemalloc
+import urllib.request
+
+from store import DB
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Slowdown of a stage, relative to the compared run, reported as a regression
+REGRESSION_THRESHOLD = 1.2
+
+RESOURCE_MAP_SQL = '''CREATE TABLE IF NOT EXISTS resource_map (
+    id INTEGER PRIMARY KEY,
+    park_id TEXT,
+    map_id TEXT,
+    location_id INTEGER,
+    name TEXT,
+    description TEXT,
+    category TEXT,
+    capacity INTEGER,
+    photos TEXT,
+    max_stay INTEGER,
+    attr BLOB
+)'''
+
+
+def _resource_rows(count, offset=0):
+    return [{
+        "id": offset + i,
+        "park_id": "-2147483559",
+        "map_id": "-2147483400",
+        "location_id": -2147483590,
+        "name": str(i),
+        "description": "Synthetic site " * 8,
+        "category": "Campsite",
+        "capacity": 6,
+        "photos": json.dumps([{"url": f"https://example.invalid/{i}.jpg", "aspectType": 0}]),
+        "max_stay": 14,
+    } for i in range(count)]
+
+
+LOCATION_SQL = '''CREATE TABLE IF NOT EXISTS location (
+    id INTEGER PRIMARY KEY,
+    full_name TEXT,
+    root_map_id TEXT
+)'''
+
+CATEGORY_SQL = '''CREATE TABLE IF NOT EXISTS category (
+    id INTEGER PRIMARY KEY,
+    name TEXT
+)'''
+
+MAP_SQL = '''CREATE TABLE IF NOT EXISTS map (
+    map_id TEXT PRIMARY KEY,
+    resource_location_id INTEGER
+)'''
+
+
+def _rate(rows, seconds):
+    return rows / seconds if seconds > 0 else float('inf')
+
+
+def bench_store(rows=2000):
+    """
+    Compare row-by-row writes (one commit each) with the batched executemany API.
+    Returns a dict of rows/sec per operation.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DB(os.path.join(tmp, 'bench.db'))
+        db.create_table(RESOURCE_MAP_SQL)
+        attr = json.dumps([{"attribute": "Ground Cover", "value": "Grass"}]).encode('utf-8')
+
+        start = time.perf_counter()
+        for row in _resource_rows(rows):
+            db.insert('resource_map', row)
+        results['insert'] = _rate(rows, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        db.insert_many('resource_map', _resource_rows(rows, offset=rows))
+        results['insert_many'] = _rate(rows, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for i in range(rows):
+            db.update_row('resource_map', {"attr": attr}, 'id = ?', (i,))
+        results['update_row'] = _rate(rows, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        db.update_many('resource_map', [({"attr": attr}, (rows + i,)) for i in range(rows)], 'id = ?')
+        results['update_many'] = _rate(rows, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        db.upsert_many('resource_map', _resource_rows(rows * 2))
+        results['upsert_many'] = _rate(rows * 2, time.perf_counter() - start)
+
+        db.close()
+    return results
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_backend(case, latency=0):
+    """
+    Start mockserver.py with a synthetic backend shaped by `case`.
+    Returns (process, base url) once it answers.
+    """
+    port = _free_port()
+    process = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, 'mockserver.py'), '--synthetic',
+        '--port', str(port),
+        '--parks', str(case['parks']),
+        '--depth', str(case['depth']),
+        '--fanout', str(case['fanout']),
+        '--sites', str(case['sites']),
+        '--availability', str(case['availability']),
+        '--latency', str(latency),
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 10
+    while True:
+        try:
+            urllib.request.urlopen(f"{url}/__mock__/stats", timeout=1).read()
+            return process, url
+        except OSError:
+            if process.poll() is not None or time.time() > deadline:
+                process.kill()
+                raise RuntimeError("mock server did not start")
+            time.sleep(0.1)
+
+
+class Stages:
+    """
+    Measure consecutive pipeline stages: wall time, API calls and peak traced memory.
+    """
+
+    def __init__(self, scraper):
+        self.scraper = scraper
+        self.results = {}
+
+    def run(self, name, fn, items=None):
+        calls = self.scraper.api_calls
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        value = fn()
+        wall = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+
+        count = items(value) if items is not None else None
+        # a full run restarts the session, which resets the call counter
+        if self.scraper.api_calls >= calls:
+            calls = self.scraper.api_calls - calls
+        else:
+            calls = self.scraper.api_calls
+        self.results[name] = {
+            "wall": round(wall, 4),
+            "calls": calls,
+            "peak_kb": peak // 1024,
+            "items": count,
+            "items_per_sec": None if count is None else round(_rate(count, wall), 1),
+        }
+        return value
+
+
+def bench_case(case, url):
+    """
+    Run every stage of one case against the backend at `url`, in the current directory.
+    """
+    import scraper as scraper_module
+    from mockserver import SyntheticBackend
+
+    scraper_module.DEBUG = False
+    parks = [str(100 + park) for park in range(1, case['parks'] + 1)]
+
+    db = DB('store.db')
+    for sql in (RESOURCE_MAP_SQL, LOCATION_SQL, CATEGORY_SQL, MAP_SQL):
+        db.create_table(sql)
+    db.upsert_many('category', [{"id": 1, "name": "Campsite"}])
+    db.upsert_many('location', [
+        {"id": SyntheticBackend.location_id(park_id), "full_name": f"Synthetic Park {park_id}", "root_map_id": park_id}
+        for park_id in parks
+    ])
+    db.close()
+
+    tracemalloc.start()
+    scraper = scraper_module.Scraper()
+    scraper.store.data.update({
+        "url": url,
+        "location": parks,
+        "days": case['days'],
+        "nights": case['nights'],
+        "concurrency": case['concurrency'],
+        "rate": 10000,
+        "burst": 1000,
+        "topology_cache": False,
+        "record": None,
+        "profiles": [],
+    })
+    scraper.limiter = scraper_module.TokenBucket(10000, 1000)
+    scraper.send_push = lambda *args, **kwargs: None
+    scraper._init_session_()
+
+    stages = Stages(scraper)
+    stages.run('discover', lambda: [scraper.dfs(park_id) for park_id in parks])
+    stages.results['discover']['calls_per_park'] = round(stages.results['discover']['calls'] / len(parks), 1)
+
+    ids = [row['id'] for row in scraper.store.fetch_all('resource_map') or []]
+    stages.run('attributes', lambda: scraper.store.update_many(
+        'resource_map', [({"attr": b'[]'}, (resource_id,)) for resource_id in ids], 'id = ?'
+    ), items=lambda updated: updated)
+    stages.run('load_index', scraper.store.load_index)
+
+    site_list = stages.run('crawl', lambda: scraper.crawl(parks, case['days']), items=len)
+    stages.results['crawl']['calls_per_park'] = round(stages.results['crawl']['calls'] / len(parks), 1)
+
+    resources = stages.run(
+        'lookup', lambda: [scraper.store.lookup('resource_map', site_id) for site_id in site_list], items=len
+    )
+    resources = [resource for resource in resources if resource is not None]
+    responses = stages.run('daily', lambda: scraper.fetch_daily(resources, case['days']), items=len)
+    found = stages.run(
+        'windows',
+        lambda: scraper.find_windows(responses, [resource['max_stay'] for resource in resources]),
+        items=lambda found: len(found),
+    )
+    entries = [
+        scraper._result_entry_(resource, found_windows)
+        for resource, found_windows in zip(resources, found) if found_windows
+    ]
+    stages.run('flush', lambda: scraper.store.flush('searchResult', {"time": "bench", "data": entries}))
+    stages.results['flush']['bytes'] = len(scraper.store.snapshot('searchResult').body)
+
+    stages.run('run', scraper.run, items=lambda stats: stats['available'])
+    scraper._del_session_()
+    tracemalloc.stop()
+
+    return {
+        "case": case,
+        "sites": len(ids),
+        "available": len(site_list),
+        "stages": stages.results,
+    }
+
+
+def run_case(case, latency=0):
+    """
+    Run `bench_case` in a fresh process and working directory, against its own mock server.
+    """
+    process, url = start_backend(case, latency)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            shutil.copytree(os.path.join(ROOT, 'store'), os.path.join(tmp, 'store'),
+                            ignore=shutil.ignore_patterns('search*.json', '*.compiled.json'))
+            key_file = os.path.join(ROOT, 'serviceAccountKey.json')
+            if os.path.exists(key_file):
+                shutil.copy(key_file, tmp)
+
+            completed = subprocess.run(
+                [sys.executable, os.path.join(ROOT, 'bench.py'), 'case', json.dumps(case), '--url', url],
+                cwd=tmp, capture_output=True, text=True,
+            )
+            if completed.returncode != 0:
+                raise RuntimeError(f"case {case} failed:\n{completed.stderr}")
+            return json.loads(completed.stdout.strip().splitlines()[-1])
+    finally:
+        process.kill()
+        process.wait()
+
+
+def sweep(parks, depth, fanout, sites, days, nights=1, concurrency=4, latency=0, availability=0.05):
+    """
+    Run one case per combination of the swept values. Returns the list of case results.
+    """
+    results = []
+    for p, d, f, s, n in itertools.product(parks, depth, fanout, sites, days):
+        case = {"parks": p, "depth": d, "fanout": f, "sites": s, "days": n,
+                "nights": nights, "concurrency": concurrency, "availability": availability}
+        print(f"parks={p} depth={d} fanout={f} sites={s} days={n}", file=sys.stderr)
+        results.append(run_case(case, latency))
+    return results
+
+
+def compare(previous, current, threshold=REGRESSION_THRESHOLD):
+    """
+    Stages of matching cases whose wall time or API calls grew by more than `threshold`.
+    Returns a list of (case, stage, metric, before, after).
+    """
+    before = {json.dumps(result['case'], sort_keys=True): result for result in previous}
+    regressions = []
+    for result in current:
+        old = before.get(json.dumps(result['case'], sort_keys=True))
+        if old is None:
+            continue
+        for stage, metrics in result['stages'].items():
+            old_metrics = old['stages'].get(stage)
+            if old_metrics is None:
+                continue
+            for metric in ('wall', 'calls'):
+                if old_metrics[metric] and metrics[metric] > old_metrics[metric] * threshold:
+                    regressions.append((result['case'], stage, metric, old_metrics[metric], metrics[metric]))
+    return regressions
+
+
+def print_results(results):
+    for result in results:
+        case = result['case']
+        print(f"\nparks={case['parks']} depth={case['depth']} fanout={case['fanout']} "
+              f"sites={case['sites']} days={case['days']} -> {result['sites']} sites, {result['available']} available")
+        print(f"  {'stage':<12} {'wall s':>9} {'calls':>7} {'peak KB':>9} {'items/s':>12}")
+        for stage, metrics in result['stages'].items():
+            rate = '' if metrics['items_per_sec'] is None else f"{metrics['items_per_sec']:,.0f}"
+            print(f"  {stage:<12} {metrics['wall']:>9.3f} {metrics['calls']:>7} {metrics['peak_kb']:>9} {rate:>12}")
+
+
+# Run in a fresh interpreter by bench_startup, prints one JSON line
+STARTUP_SCRIPT = """
+import sys, time, json
+sys.path.insert(0, sys.argv[1])
+start = time.perf_counter()
+import scraper
+imported = time.perf_counter()
+import server
+created = time.perf_counter()
+server.app.test_client().get('/api/settings')
+answered = time.perf_counter()
+print(json.dumps({
+    "import_scraper": imported - start,
+    "import_server": created - imported,
+    "first_request": answered - created,
+    "total": answered - start,
+    "loaded": [name for name in sys.argv[2:] if name in sys.modules],
+}))
+"""
+
+# Heavy dependencies the server should not load before it needs them
+HEAVY_MODULES = ('requests', 'numpy', 'firebase_admin', 'selenium', 'webdriver_manager')
+
+
+def bench_startup(repeat=5, top=10):
+    """
+    Cold start of server.py in `repeat` fresh processes. Returns the median of each
+    phase in seconds, the process wall time, the heavy modules loaded by the first
+    request, and the `top` slowest imports (cumulative microseconds).
+    """
+    runs, walls = [], []
+    with tempfile.TemporaryDirectory() as tmp:
+        shutil.copytree(os.path.join(ROOT, 'store'), os.path.join(tmp, 'store'),
+                        ignore=shutil.ignore_patterns('search*.json', '*.compiled.json'))
+        for _ in range(repeat):
+            start = time.perf_counter()
+            completed = subprocess.run(
+                [sys.executable, '-c', STARTUP_SCRIPT, ROOT, *HEAVY_MODULES],
+                cwd=tmp, capture_output=True, text=True,
+            )
+            walls.append(time.perf_counter() - start)
+            if completed.returncode != 0:
+                raise RuntimeError(f"startup failed:\n{completed.stderr}")
+            runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+        completed = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import sys; sys.path.insert(0, {ROOT!r}); import server'],
+            cwd=tmp, capture_output=True, text=True,
+        )
+
+    imports = []
+    for line in completed.stderr.splitlines():
+        parts = line.split('|')
+        if line.startswith('import time:') and len(parts) == 3 and parts[1].strip().isdigit():
+            imports.append((int(parts[1]), parts[2].strip()))
+    imports.sort(reverse=True)
+
+    result = {phase: statistics.median(run[phase] for run in runs)
+              for phase in ('import_scraper', 'import_server', 'first_request', 'total')}
+    result["process"] = statistics.median(walls)
+    result["loaded"] = runs[-1]["loaded"]
+    result["imports"] = imports[:top]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    store_parser = sub.add_parser('store', help='SQLite write throughput, row by row vs batched')
+    store_parser.add_argument('--rows', type=int, default=2000)
+
+    e2e_parser = sub.add_parser('e2e', help='whole pipeline against a synthetic backend, swept over sizes')
+    e2e_parser.add_argument('--parks', type=int, nargs='+', default=[1, 2])
+    e2e_parser.add_argument('--depth', type=int, nargs='+', default=[2])
+    e2e_parser.add_argument('--fanout', type=int, nargs='+', default=[3])
+    e2e_parser.add_argument('--sites', type=int, nargs='+', default=[8])
+    e2e_parser.add_argument('--days', type=int, nargs='+', default=[60])
+    e2e_parser.add_argument('--nights', type=int, default=1)
+    e2e_parser.add_argument('--concurrency', type=int, default=4)
+    e2e_parser.add_argument('--latency', type=float, default=0, help='mock server latency in ms')
+    e2e_parser.add_argument('--availability', type=float, default=0.05, help='chance a site is free on a night')
+    e2e_parser.add_argument('--out', help='write the results to this JSON file')
+    e2e_parser.add_argument('--compare', help='results JSON of a previous version to compare with')
+
+    startup_parser = sub.add_parser('startup', help='server cold start: imports, Scraper creation, first request')
+    startup_parser.add_argument('--repeat', type=int, default=5)
+    startup_parser.add_argument('--top', type=int, default=10, help='number of slowest imports to list')
+
+    case_parser = sub.add_parser('case', help=argparse.SUPPRESS)
+    case_parser.add_argument('case')
+    case_parser.add_argument('--url', required=True)
+
+    args = parser.parse_args()
+
+    if args.command == 'store':
+        for name, rate in bench_store(args.rows).items():
+            print(f"{name:<12} {rate:>12,.0f} rows/sec")
+
+    elif args.command == 'startup':
+        result = bench_startup(args.repeat, args.top)
+        for phase in ('import_scraper', 'import_server', 'first_request', 'total', 'process'):
+            print(f"{phase:<16} {result[phase] * 1000:>9.1f} ms")
+        print(f"heavy modules loaded: {', '.join(result['loaded']) or 'none'}")
+        print("\nslowest imports (cumulative):")
+        for microseconds, name in result['imports']:
+            print(f"  {microseconds / 1000:>9.1f} ms  {name}")
+
+    elif args.command == 'case':
+        print(json.dumps(bench_case(json.loads(args.case), args.url)))
+
+    elif args.command == 'e2e':
+        results = sweep(args.parks, args.depth, args.fanout, args.sites, args.days,
+                        args.nights, args.concurrency, args.latency, args.availability)
+        print_results(results)
+
+        if args.compare:
+            with open(args.compare, encoding='utf-8') as fp:
+                previous = json.load(fp)['results']
+            regressions = compare(previous, results)
+            print(f"\n{len(regressions)} regressions against {args.compare}")
+            for case, stage, metric, before, after in regressions:
+                print(f"  {json.dumps(case)} {stage} {metric}: {before} -> {after}")
+
+        if args.out:
+            with open(args.out, 'w', encoding='utf-8') as fp:
+                json.dump({"time": time.strftime("%Y-%m-%d %H:%M:%S"), "results": results}, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+from typing import Any, Dict, List, Tuple
+
+WindowKey = Tuple[Any, str, str]
+
+
+def site_windows(entry: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Windows of a search result entry (older results only carry one start/end pair)."""
+    if entry.get('windows'):
+        return entry['windows']
+    if entry.get('start_date') and entry.get('end_date'):
+        return [{
+            "start_date": entry['start_date'],
+            "end_date": entry['end_date'],
+            "booking_url": entry.get('booking_url'),
+        }]
+    return []
+
+
+def window_keys(results: Dict[str, Any]) -> Dict[WindowKey, Dict[str, Any]]:
+    """Map every (site id, start date, end date) hit of a search result to its site entry."""
+    keys = {}
+    for entry in (results or {}).get('data', []):
+        for window in site_windows(entry):
+            keys[(entry['id'], window['start_date'], window['end_date'])] = entry
+    return keys
+
+
+def diff_results(previous: Dict[str, Any], current: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Compare two searchResult snapshots window by window.
+    Returns:
+        {"time", "since", "added": [site entries holding only their new windows],
+         "removed": [{"id", "site", "start_date", "end_date"}], "unchanged": count}
+    """
+    old_keys = window_keys(previous)
+    new_keys = window_keys(current)
+
+    added = {}
+    for entry in (current or {}).get('data', []):
+        new_windows = [
+            window for window in site_windows(entry)
+            if (entry['id'], window['start_date'], window['end_date']) not in old_keys
+        ]
+        if new_windows:
+            added[entry['id']] = dict(entry, windows=new_windows)
+
+    removed = [
+        {"id": site_id, "site": entry.get('site'), "start_date": start_date, "end_date": end_date}
+        for (site_id, start_date, end_date), entry in old_keys.items()
+        if (site_id, start_date, end_date) not in new_keys
+    ]
+
+    return {
+        "time": (current or {}).get('time'),
+        "since": (previous or {}).get('time'),
+        "added": list(added.values()),
+        "removed": removed,
+        "unchanged": len(new_keys.keys() & old_keys.keys()),
+    }
+
+
+def carry_over_cart_flags(previous: Dict[str, Any], current: Dict[str, Any]):
+    """Keep `added_to_cart` of sites that were already in the previous result."""
+    in_cart = {entry['id'] for entry in (previous or {}).get('data', []) if entry.get('added_to_cart')}
+    for entry in (current or {}).get('data', []):
+        if entry['id'] in in_cart:
+            entry['added_to_cart'] = True
@@ -0,0 +1,206 @@
+import time
+import json
+import zlib
+import hashlib
+import sqlite3
+from typing import Any, Dict, List, Optional, Tuple
+
+from store import DB
+
+# Stages of a checkpointed crawl
+CRAWL = "crawl"
+DAILY = "daily"
+DONE = "done"
+
+Path = Tuple[int, ...]
+
+
+def checkpoint_key(*parts) -> str:
+    """Stable key of the crawl described by `parts` (JSON serializable)."""
+    return hashlib.sha1(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+class CrawlCheckpoint:
+    """
+    Persistent progress of one crawl (a run's crawl group), so a run restarted
+    after a crash or a cancel resumes where the previous one stopped.
+
+    The map crawl is saved as a frontier: every map scheduled so far with its
+    DFS path, pending until its response was expanded, then with the available
+    sites found on it. Once the crawl is over only its site list is kept, then
+    the daily availability responses as they arrive.
+
+    A checkpoint belongs to the run that started at `started` (a timestamp): a
+    later run resumes it only on the same day and within `max_age` seconds of
+    that start, otherwise it starts over. Checkpoints of runs started more than
+    `keep` seconds ago are deleted.
+    """
+
+    def __init__(self, db: DB, key: str, today: str, started: float, max_age: float = 1800, keep: float = 3600):
+        self.db = db
+        self.key = key
+        self.today = today
+        self.started = started
+
+        self.db.create_table('''CREATE TABLE IF NOT EXISTS crawl_checkpoint (
+            key TEXT PRIMARY KEY,
+            today TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            roots TEXT,
+            sites TEXT,
+            failed TEXT,
+            batch TEXT,
+            started_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )''')
+        self.db.create_table('''CREATE TABLE IF NOT EXISTS crawl_frontier (
+            key TEXT NOT NULL,
+            path TEXT NOT NULL,
+            map_id TEXT NOT NULL,
+            sites TEXT,
+            PRIMARY KEY (key, path)
+        )''')
+        self.db.create_table('''CREATE TABLE IF NOT EXISTS crawl_daily (
+            key TEXT NOT NULL,
+            resource_id INTEGER NOT NULL,
+            response BLOB NOT NULL,
+            PRIMARY KEY (key, resource_id)
+        )''')
+
+        self.prune(keep)
+        self.row = self.db.fetch_one('crawl_checkpoint', 'key = ?', (key,))
+        if self.row is not None and (self.row['today'] != today or started - self.row['started_at'] > max_age):
+            self.clear()
+
+    @property
+    def stage(self) -> Optional[str]:
+        """CRAWL, DAILY or DONE, None before the crawl started."""
+        return self.row['stage'] if self.row is not None else None
+
+    @property
+    def started_at(self) -> float:
+        """Start of the run the checkpoint belongs to, this run's if it is not resuming one."""
+        return self.row['started_at'] if self.row is not None else self.started
+
+    @property
+    def roots(self) -> Optional[List[str]]:
+        return json.loads(self.row['roots']) if self.row is not None and self.row['roots'] else None
+
+    @property
+    def sites(self) -> Optional[List[str]]:
+        """Site list of the finished crawl, None while crawling."""
+        return json.loads(self.row['sites']) if self.row is not None and self.row['sites'] else None
+
+    @property
+    def failed(self) -> List[str]:
+        """Parks of the finished crawl whose sites could not all be crawled."""
+        return json.loads(self.row['failed']) if self.row is not None and self.row['failed'] else []
+
+    @property
+    def batch(self) -> Optional[str]:
+        """Work queue batch of a sharded crawl."""
+        return self.row['batch'] if self.row is not None else None
+
+    def _save(self, **fields):
+        row = dict(self.row or {"key": self.key, "today": self.today, "stage": CRAWL,
+                                "roots": None, "sites": None, "failed": None, "batch": None,
+                                "started_at": self.started})
+        row.update(fields, updated_at=time.time())
+        self.db.upsert_many('crawl_checkpoint', [row], conflict='key')
+        self.row = row
+
+    def begin(self, roots: List[str]):
+        """Start the frontier with the crawl roots, pending."""
+        with self.db.transaction():
+            self.db.delete_row('crawl_frontier', 'key = ?', (self.key,))
+            self.db.insert_many('crawl_frontier', [
+                {"key": self.key, "path": json.dumps([index]), "map_id": str(map_id), "sites": None}
+                for index, map_id in enumerate(roots)
+            ])
+            self._save(stage=CRAWL, roots=json.dumps([str(map_id) for map_id in roots]))
+
+    def frontier(self) -> Tuple[List[Tuple[Path, List[str]]], List[Tuple[str, Path]]]:
+        """
+        Saved crawl progress.
+        Returns:
+            A tuple of ([(path, site_ids)] of expanded maps with sites, [(map_id, path)] of pending maps).
+        """
+        found, pending = [], []
+        for row in self.db.fetch_all('crawl_frontier', 'key = ?', (self.key,)) or []:
+            path = tuple(json.loads(row['path']))
+            if row['sites'] is None:
+                pending.append((row['map_id'], path))
+            else:
+                site_ids = json.loads(row['sites'])
+                if site_ids:
+                    found.append((path, site_ids))
+        pending.sort(key=lambda item: item[1])
+        return found, pending
+
+    def expand(self, path: Path, site_ids: List[str], children: List[Tuple[str, Path]]):
+        """Mark the map at `path` as crawled, with its available sites, and add its children as pending."""
+        try:
+            with self.db.transaction() as conn:
+                conn.execute('UPDATE crawl_frontier SET sites = ? WHERE key = ? AND path = ?',
+                             (json.dumps(site_ids), self.key, json.dumps(list(path))))
+                if children:
+                    conn.executemany(
+                        'INSERT OR IGNORE INTO crawl_frontier (key, path, map_id, sites) VALUES (?, ?, ?, NULL)',
+                        [(self.key, json.dumps(list(child_path)), str(map_id)) for map_id, child_path in children]
+                    )
+                conn.execute('UPDATE crawl_checkpoint SET updated_at = ? WHERE key = ?', (time.time(), self.key))
+        except sqlite3.Error as e:
+            print(f"Checkpoint error: {e}")
+
+    def crawled(self, site_ids: List[str], failed: List[str] = ()):
+        """
+        Keep only the site list of the finished crawl (and its `failed` parks);
+        the daily availability fetch comes next.
+        """
+        with self.db.transaction():
+            self._save(stage=DAILY, sites=json.dumps([str(site_id) for site_id in site_ids]),
+                       failed=json.dumps(list(failed)) if failed else None)
+            self.db.delete_row('crawl_frontier', 'key = ?', (self.key,))
+
+    def set_batch(self, batch: str):
+        self._save(batch=batch)
+
+    def responses(self) -> Dict[int, Any]:
+        """Daily availability responses saved so far, by resource id."""
+        rows = self.db.fetch_all('crawl_daily', 'key = ?', (self.key,)) or []
+        return {row['resource_id']: json.loads(zlib.decompress(row['response'])) for row in rows}
+
+    def save_responses(self, responses: Dict[int, Any]):
+        """Save daily availability responses by resource id."""
+        if not responses:
+            return
+        with self.db.transaction():
+            self.db.upsert_many('crawl_daily', [
+                {"key": self.key, "resource_id": int(resource_id),
+                 "response": zlib.compress(json.dumps(response).encode('utf-8'))}
+                for resource_id, response in responses.items()
+            ], conflict='key, resource_id')
+            self.db.execute('UPDATE crawl_checkpoint SET updated_at = ? WHERE key = ?', (time.time(), self.key))
+
+    def done(self):
+        """The crawl's results are published; a restarted run skips it."""
+        with self.db.transaction():
+            self._save(stage=DONE, sites=None)
+            self.db.delete_row('crawl_daily', 'key = ?', (self.key,))
+
+    def prune(self, max_age: float):
+        """Delete every checkpoint (of any crawl) of a run started more than `max_age` seconds ago."""
+        expired = time.time() - max_age
+        with self.db.transaction():
+            for table in ('crawl_frontier', 'crawl_daily'):
+                self.db.execute(
+                    f'DELETE FROM {table} WHERE key IN (SELECT key FROM crawl_checkpoint WHERE started_at < ?)',
+                    (expired,)
+                )
+            self.db.delete_row('crawl_checkpoint', 'started_at < ?', (expired,))
+
+    def clear(self):
+        with self.db.transaction():
+            for table in ('crawl_frontier', 'crawl_daily', 'crawl_checkpoint'):
+                self.db.delete_row(table, 'key = ?', (self.key,))
+        self.row = None
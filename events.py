@@ -0,0 +1,55 @@
+import json
+import time
+import threading
+from collections import deque
+from typing import Any, List, Optional, Tuple
+
+Event = Tuple[int, str, Any]
+
+
+class EventBus:
+    """
+    Fan-out of scraper events to any number of listeners.
+
+    Events go into one bounded ring buffer with increasing ids; listeners keep
+    only the id of the last event they saw and sleep on a shared Condition, so
+    an idle listener costs no queue, no copy of the data and no polling.
+
+    Ids keep increasing across restarts (they are seeded from the clock), so a
+    client resuming with an id from before a restart gets the whole buffer; an
+    id ahead of the last event cannot come from this process and is treated the same.
+    """
+
+    def __init__(self, size: int = 1000):
+        self.buffer = deque(maxlen=size)
+        self.last_id = int(time.time() * 1000)
+        self.condition = threading.Condition()
+
+    def publish(self, event: str, data: Any) -> int:
+        """Append an event and wake every waiting listener. Returns its id."""
+        with self.condition:
+            self.last_id += 1
+            self.buffer.append((self.last_id, event, data))
+            self.condition.notify_all()
+            return self.last_id
+
+    def since(self, last_id: int) -> List[Event]:
+        """Buffered events newer than `last_id` (the oldest may have been dropped)."""
+        with self.condition:
+            if last_id > self.last_id:
+                return list(self.buffer)
+            if last_id == self.last_id:
+                return []
+            return [item for item in self.buffer if item[0] > last_id]
+
+    def wait(self, last_id: int, timeout: Optional[float] = None) -> List[Event]:
+        """Block until there are events newer than `last_id` or `timeout` expires."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.last_id > last_id or (last_id > self.last_id and self.buffer),
+                                    timeout=timeout)
+        return self.since(last_id)
+
+    @staticmethod
+    def format_sse(item: Event) -> str:
+        event_id, event, data = item
+        return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
@@ -0,0 +1,264 @@
+import time
+import zlib
+import threading
+from datetime import date, datetime
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from store import DB
+import windows
+
+Frame = Tuple[Dict[str, Any], np.ndarray, np.ndarray]
+
+
+def _pack_bits(matrix: np.ndarray) -> bytes:
+    return zlib.compress(np.packbits(matrix, axis=1).tobytes(), 9)
+
+
+def _unpack_bits(blob: bytes, rows: int, days: int) -> np.ndarray:
+    packed = np.frombuffer(zlib.decompress(blob), dtype=np.uint8).reshape(rows, -1)
+    return np.unpackbits(packed, axis=1, count=days).astype(bool)
+
+
+def _pack_ids(resource_ids: np.ndarray) -> bytes:
+    return zlib.compress(resource_ids.astype(np.int64).tobytes(), 9)
+
+
+def _unpack_ids(blob: bytes) -> np.ndarray:
+    return np.frombuffer(zlib.decompress(blob), dtype=np.int64)
+
+
+def _time_str(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class AvailabilityHistory:
+    """
+    Per-park history of every site's daily availability, one snapshot per run.
+
+    A snapshot is a (sites x days) bit matrix of free nights. The first snapshot
+    of a park on a given day, or after its site list changed, is a keyframe and
+    stores the matrix itself; the following ones store only the XOR with the
+    snapshot before them. Both are bit-packed and deflated, so the mostly-zero
+    deltas of 30-minute runs shrink to a few bytes per changed night. Sites that
+    were not fetched in a run (fully booked at map level) count as booked; sites
+    whose fetch failed keep their previous state, or are left out of a keyframe.
+    """
+
+    def __init__(self, db: DB):
+        self.db = db
+        self.lock = threading.Lock()
+        # park -> (keyframe row id, resource ids, matrix, start day) of its latest snapshot
+        self.latest: Dict[str, Tuple[int, np.ndarray, np.ndarray, int]] = {}
+
+        self.db.create_table('''CREATE TABLE IF NOT EXISTS availability_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            park_id TEXT NOT NULL,
+            taken_at REAL NOT NULL,
+            start_day INTEGER NOT NULL,
+            days INTEGER NOT NULL,
+            keyframe_id INTEGER,
+            resource_ids BLOB,
+            bits BLOB NOT NULL
+        )''')
+        self.db.create_table(
+            'CREATE INDEX IF NOT EXISTS availability_history_park ON availability_history (park_id, taken_at)'
+        )
+
+    def record(self, park_id, resource_ids: Sequence[int], responses: Dict[int, Optional[list]],
+               start: date, days: int, taken_at: Optional[float] = None,
+               unknown: Sequence[int] = ()) -> Optional[int]:
+        """
+        Store one snapshot of a park.
+        Args:
+            park_id: park of the snapshot.
+            resource_ids: every site of the park.
+            responses: daily availability responses by resource id, for the sites fetched this run.
+            start: date of the first day of the responses.
+            days: number of days in the snapshot.
+            taken_at: snapshot time, now if None.
+            unknown: sites whose availability could not be fetched this run.
+        Returns:
+            The id of the stored row, or None on error.
+        """
+        park_id = str(park_id)
+        ids = np.array(sorted(int(resource_id) for resource_id in resource_ids), dtype=np.int64)
+        start_day = start.toordinal()
+        unknown = {int(resource_id) for resource_id in unknown}
+
+        latest = self._latest(park_id)
+        previous = None
+        if latest is not None and latest[2].shape == (len(ids), days) and latest[3] == start_day \
+                and np.array_equal(latest[1], ids):
+            previous = latest[2]
+        elif unknown:
+            # no previous state to keep, leave them out
+            ids = np.array([resource_id for resource_id in ids.tolist() if resource_id not in unknown], dtype=np.int64)
+
+        matrix = np.zeros((len(ids), days), dtype=bool)
+        fetched = [(row, responses[resource_id]) for row, resource_id in enumerate(ids.tolist()) if resource_id in responses]
+        if fetched:
+            matrix[[row for row, _ in fetched]] = windows.pack([daily for _, daily in fetched], days) == windows.AVAILABLE
+        if previous is not None and unknown:
+            rows = [row for row, resource_id in enumerate(ids.tolist()) if resource_id in unknown]
+            matrix[rows] = previous[rows]
+
+        data = {
+            "park_id": park_id,
+            "taken_at": time.time() if taken_at is None else taken_at,
+            "start_day": start_day,
+            "days": days,
+        }
+
+        with self.lock:
+            if (latest is not None and latest[2].shape == matrix.shape
+                    and latest[3] == start_day and np.array_equal(latest[1], ids)):
+                data.update(keyframe_id=latest[0], bits=_pack_bits(matrix ^ latest[2]))
+                row_id = self.db.insert('availability_history', data)
+                keyframe_id = latest[0]
+            else:
+                data.update(keyframe_id=None, resource_ids=_pack_ids(ids), bits=_pack_bits(matrix))
+                row_id = keyframe_id = self.db.insert('availability_history', data)
+            if row_id is not None:
+                self.latest[park_id] = (keyframe_id, ids, matrix, start_day)
+            return row_id
+
+    def _latest(self, park_id: str):
+        with self.lock:
+            if park_id in self.latest:
+                return self.latest[park_id]
+        frame = None
+        row = self.db.fetch_one('availability_history', 'park_id = ? ORDER BY id DESC LIMIT 1', (park_id,))
+        if row is not None:
+            for frame in self._replay(park_id, row['keyframe_id'] or row['id'], row['id']):
+                pass
+        if frame is None:
+            return None
+        row, ids, matrix = frame
+        latest = (row['keyframe_id'] or row['id'], ids, matrix, row['start_day'])
+        with self.lock:
+            self.latest.setdefault(park_id, latest)
+        return latest
+
+    def _replay(self, park_id: str, first_id: int, last_id: Optional[int] = None) -> Iterator[Frame]:
+        """Decode the snapshots of a park from row `first_id` (a keyframe) on, in order."""
+        where = 'park_id = ? AND id >= ?'
+        params = [park_id, first_id]
+        if last_id is not None:
+            where += ' AND id <= ?'
+            params.append(last_id)
+        rows = self.db.fetch_all('availability_history', f'{where} ORDER BY id', tuple(params)) or []
+
+        ids = matrix = None
+        for row in rows:
+            if row['keyframe_id'] is None:
+                ids = _unpack_ids(row['resource_ids'])
+                matrix = _unpack_bits(row['bits'], len(ids), row['days'])
+            elif matrix is None:
+                # delta whose keyframe was pruned
+                continue
+            else:
+                matrix = matrix ^ _unpack_bits(row['bits'], len(ids), row['days'])
+            yield row, ids, matrix
+
+    def frames(self, park_id, since: Optional[float] = None, until: Optional[float] = None) -> Iterator[Frame]:
+        """
+        Decoded snapshots of a park in time order: (row, resource ids, matrix).
+        """
+        park_id = str(park_id)
+        where, params = 'park_id = ?', [park_id]
+        if since is not None:
+            where += ' AND taken_at >= ?'
+            params.append(since)
+        first = self.db.fetch_one('availability_history', f'{where} ORDER BY id LIMIT 1', tuple(params))
+        if first is None:
+            return
+
+        # deltas chain back to their keyframe, decode from there
+        for row, ids, matrix in self._replay(park_id, first['keyframe_id'] or first['id']):
+            if since is not None and row['taken_at'] < since:
+                continue
+            if until is not None and row['taken_at'] > until:
+                break
+            yield row, ids, matrix
+
+    def park_summary(self, park_id, since: Optional[float] = None, until: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Per snapshot of a park: sites with a free night, free site-nights, and the
+        nights that opened up / got booked since the previous snapshot.
+        """
+        summary, previous = [], None
+        for row, ids, matrix in self.frames(park_id, since, until):
+            entry = {
+                "time": _time_str(row['taken_at']),
+                "sites": int(matrix.any(axis=1).sum()),
+                "nights": int(matrix.sum()),
+                "opened": None,
+                "closed": None,
+            }
+            if previous is not None:
+                before, after = self._align(previous, (row, ids, matrix))
+                if before is not None:
+                    entry["opened"] = int((after & ~before).sum())
+                    entry["closed"] = int((before & ~after).sum())
+            summary.append(entry)
+            previous = (row, ids, matrix)
+        return summary
+
+    def site_history(self, park_id, resource_id, since: Optional[float] = None,
+                     until: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        When nights of a site opened up: one entry per snapshot where some night
+        became free, {"time", "opened": [dates], "closed": [dates]}.
+        """
+        resource_id = int(resource_id)
+        changes, previous = [], None
+        for row, ids, matrix in self.frames(park_id, since, until):
+            index = np.searchsorted(ids, resource_id)
+            if index >= len(ids) or ids[index] != resource_id:
+                previous = None
+                continue
+            current = (row, matrix[index])
+            if previous is not None:
+                first = max(previous[0]['start_day'], row['start_day'])
+                last = min(previous[0]['start_day'] + previous[0]['days'], row['start_day'] + row['days'])
+                if first < last:
+                    before = previous[1][first - previous[0]['start_day']:last - previous[0]['start_day']]
+                    after = current[1][first - row['start_day']:last - row['start_day']]
+                    opened = np.nonzero(after & ~before)[0]
+                    closed = np.nonzero(before & ~after)[0]
+                    if len(opened) or len(closed):
+                        changes.append({
+                            "time": _time_str(row['taken_at']),
+                            "opened": [date.fromordinal(first + int(day)).isoformat() for day in opened],
+                            "closed": [date.fromordinal(first + int(day)).isoformat() for day in closed],
+                        })
+            previous = current
+        return changes
+
+    @staticmethod
+    def _align(previous: Frame, current: Frame):
+        """Both matrices restricted to their common sites and days, (None, None) if there are none."""
+        (prev_row, prev_ids, prev_matrix), (row, ids, matrix) = previous, current
+        first = max(prev_row['start_day'], row['start_day'])
+        last = min(prev_row['start_day'] + prev_row['days'], row['start_day'] + row['days'])
+        common, prev_index, index = np.intersect1d(prev_ids, ids, assume_unique=True, return_indices=True)
+        if first >= last or not len(common):
+            return None, None
+        before = prev_matrix[prev_index, first - prev_row['start_day']:last - prev_row['start_day']]
+        after = matrix[index, first - row['start_day']:last - row['start_day']]
+        return before, after
+
+    def prune(self, max_age_days: float) -> Optional[int]:
+        """
+        Delete snapshots older than `max_age_days`, keeping whole chains
+        (keyframe and deltas) that newer snapshots still build on.
+        """
+        cutoff = time.time() - max_age_days * 86400
+        return self.db.delete_row(
+            'availability_history',
+            'taken_at < ? AND COALESCE(keyframe_id, id) NOT IN (SELECT keyframe_id FROM availability_history '
+            'WHERE keyframe_id IS NOT NULL AND taken_at >= ?)',
+            (cutoff, cutoff)
+        )
@@ -0,0 +1,130 @@
+import time
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlencode, urlparse
+
+from store import DB
+
+# Endpoints whose payload is effectively static, with their time-to-live in seconds
+DEFAULT_TTLS = {
+    "/api/resourcelocation/resources": 24 * 3600,
+}
+
+
+class ResponseCache:
+    """
+    Two level cache for JSON responses of static GET endpoints.
+
+    Entries live in an in-memory LRU backed by the `http_cache` table, so a
+    restart does not refetch everything. Expired entries that carried an
+    ETag / Last-Modified are revalidated with a conditional request.
+    """
+
+    def __init__(self, db: DB, ttls: Optional[Dict[str, int]] = None, max_entries: int = 256):
+        self.db = db
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.max_entries = max_entries
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "revalidated": 0}
+
+        self.db.create_table('''CREATE TABLE IF NOT EXISTS http_cache (
+            key TEXT PRIMARY KEY,
+            body TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            stored_at REAL NOT NULL
+        )''')
+
+    def ttl(self, url: str) -> Optional[int]:
+        """Time-to-live of `url`, or None if the endpoint is not cacheable."""
+        path = urlparse(url).path
+        for prefix, ttl in self.ttls.items():
+            if path.startswith(prefix):
+                return ttl
+        return None
+
+    @staticmethod
+    def key(url: str, params: Optional[Dict[str, Any]] = None) -> str:
+        if not params:
+            return url
+        return f"{url}?{urlencode(sorted(params.items()))}"
+
+    def _remember(self, key: str, entry: Dict[str, Any]):
+        with self.lock:
+            self.memory[key] = entry
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+
+    def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                self.memory.move_to_end(key)
+                return entry
+
+        row = self.db.fetch_one('http_cache', 'key = ?', (key,))
+        if row is None:
+            return None
+        entry = {
+            "body": json.loads(row['body']),
+            "etag": row['etag'],
+            "last_modified": row['last_modified'],
+            "stored_at": row['stored_at'],
+        }
+        self._remember(key, entry)
+        return entry
+
+    def lookup(self, url: str, params: Optional[Dict[str, Any]], ttl: int) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """
+        Find the cached entry of a request.
+        Returns:
+            (entry, fresh): entry is None on a miss; fresh tells if it can be used without revalidation.
+        """
+        entry = self._get(self.key(url, params))
+        fresh = entry is not None and time.time() - entry['stored_at'] < ttl
+        with self.lock:
+            self.stats["hits" if fresh else "misses"] += 1
+        return entry, fresh
+
+    @staticmethod
+    def conditional_headers(entry: Optional[Dict[str, Any]]) -> Dict[str, str]:
+        """Validators to send when revalidating a stale entry."""
+        headers = {}
+        if entry is None:
+            return headers
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def put(self, url: str, params: Optional[Dict[str, Any]], body: Any, headers=None):
+        """Store a fresh 200 response."""
+        headers = headers or {}
+        key = self.key(url, params)
+        entry = {
+            "body": body,
+            "etag": headers.get('ETag'),
+            "last_modified": headers.get('Last-Modified'),
+            "stored_at": time.time(),
+        }
+        self._remember(key, entry)
+        self.db.execute(
+            'INSERT OR REPLACE INTO http_cache (key, body, etag, last_modified, stored_at) VALUES (?, ?, ?, ?, ?)',
+            (key, json.dumps(body), entry['etag'], entry['last_modified'], entry['stored_at']),
+            commit=True
+        )
+
+    def refresh(self, url: str, params: Optional[Dict[str, Any]], entry: Dict[str, Any]) -> Any:
+        """Mark a stale entry fresh again after a 304 and return its body."""
+        key = self.key(url, params)
+        entry = dict(entry, stored_at=time.time())
+        self._remember(key, entry)
+        self.db.execute('UPDATE http_cache SET stored_at = ? WHERE key = ?', (entry['stored_at'], key), commit=True)
+        with self.lock:
+            self.stats["revalidated"] += 1
+        return entry['body']
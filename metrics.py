@@ -0,0 +1,185 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Default histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+CRAWL_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in values]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    """
+    Cumulative histogram; `observe` is one bisect and one locked update.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket (+Inf last), sum]
+        self.values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self.lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self.values.items())
+        lines = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """
+    Named metrics rendered together in the Prometheus text exposition format.
+    Registering an existing name returns the metric already registered.
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self.lock = threading.Lock()
+
+    def _register(self, cls, name, documentation, labels, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, documentation, labels, **kwargs)
+            return metric
+
+    def counter(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Counter:
+        return self._register(Counter, name, documentation, labels)
+
+    def gauge(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge, name, documentation, labels)
+
+    def histogram(self, name: str, documentation: str, labels: Iterable[str] = (),
+                  buckets: Optional[Iterable[float]] = None) -> Histogram:
+        return self._register(Histogram, name, documentation, labels, buckets=tuple(buckets or LATENCY_BUCKETS))
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+# Process-wide registry served at /api/metrics
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter(
+    'parks_api_requests_total', 'Reservation API responses by endpoint and status code.', ('endpoint', 'status'))
+REQUEST_SECONDS = REGISTRY.histogram(
+    'parks_api_request_seconds', 'Reservation API request latency by endpoint.', ('endpoint',))
+RETRIES = REGISTRY.counter(
+    'parks_api_retries_total', 'Retried reservation API requests by endpoint and reason.', ('endpoint', 'reason'))
+CACHE = REGISTRY.counter(
+    'parks_http_cache_total', 'Response cache lookups by result (hit, miss, revalidated).', ('result',))
+DB_SECONDS = REGISTRY.histogram(
+    'parks_db_query_seconds', 'SQLite statement time by operation.', ('op',), buckets=DB_BUCKETS)
+CRAWL_SECONDS = REGISTRY.histogram(
+    'parks_crawl_park_seconds', 'Time to crawl the map tree of a park.', ('park',), buckets=CRAWL_BUCKETS)
+CRAWL_SITES = REGISTRY.gauge(
+    'parks_crawl_park_sites', 'Available sites found in a park by the last crawl.', ('park',))
+RUN_SECONDS = REGISTRY.histogram(
+    'parks_run_seconds', 'Duration of complete scraper runs.', (), buckets=CRAWL_BUCKETS)
+RUNS = REGISTRY.counter(
+    'parks_runs_total', 'Scraper runs by outcome.', ('status',))
+PUSHES = REGISTRY.counter(
+    'parks_push_total', 'Push notifications per device by outcome (sent, invalid, transient, failed).', ('result',))
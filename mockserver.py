@@ -0,0 +1,284 @@
+"""
+Local stand-in for the reservation site.
+
+Replay a recording made with the `record` setting:
+
+    python mockserver.py store/recording.jsonl --port 8080 --latency 80 --jitter 40 --rate 5
+
+or serve a generated park tree of any size:
+
+    python mockserver.py --synthetic --parks 3 --depth 3 --fanout 4 --sites 12
+
+Then point the scraper at it with "url": "http://localhost:8080" in ini.json.
+Repeated requests get the recorded responses in order, then the last one again;
+requests that were never recorded get a 404.
+"""
+import math
+import time
+import random
+import argparse
+import threading
+from datetime import date
+from urllib.parse import parse_qsl, urlparse
+
+from flask import Flask, Response, jsonify, request
+
+from ratelimit import TokenBucket
+from recorder import load_recording, request_key
+
+
+class MockBackend:
+    """
+    Simulated latency and server-side rate limiting around `respond`.
+    """
+
+    def __init__(self, latency: float = 0, jitter: float = 0, rate: float = None,
+                 burst: int = 4, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.limiter = TokenBucket(rate, burst) if rate else None
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "replayed": 0, "missing": 0, "throttled": 0}
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def delay(self) -> float:
+        with self.lock:
+            extra = self.random.uniform(0, self.jitter) if self.jitter else 0
+        return (self.latency + extra) / 1000
+
+    def respond(self, method, url, params, data):
+        """(status, headers, body) answering the request, None if there is none."""
+        raise NotImplementedError
+
+    def handle(self, method, url, params, data):
+        self._count("requests")
+
+        if self.limiter is not None:
+            wait = self.limiter.try_acquire()
+            if wait:
+                self._count("throttled")
+                return 429, {"Retry-After": str(math.ceil(wait))}, {"error": "Too Many Requests"}
+
+        delay = self.delay()
+        if delay:
+            time.sleep(delay)
+
+        response = self.respond(method, url, params, data)
+        if response is None:
+            self._count("missing")
+            return 404, {}, {"error": "Not found", "key": request_key(method, url, params, data)}
+        self._count("replayed")
+        return response
+
+
+class Replay(MockBackend):
+    """
+    Recorded responses, looked up by `recorder.request_key`.
+    """
+
+    def __init__(self, responses, **kwargs):
+        super().__init__(**kwargs)
+        self.responses = responses
+        self.served = {}
+
+    def respond(self, method, url, params, data):
+        key = request_key(method, url, params, data)
+        entries = self.responses.get(key)
+        if not entries:
+            return None
+        with self.lock:
+            index = self.served.get(key, 0)
+            self.served[key] = index + 1
+        entry = entries[min(index, len(entries) - 1)]
+        return entry['status'], entry.get('headers') or {}, entry['body']
+
+
+class SyntheticBackend(MockBackend):
+    """
+    Deterministic park trees: each of `parks` roots ("101", "102", ...) has
+    `depth` levels of `fanout` child maps (child ids append a digit to the parent
+    id) and `sites` sites per leaf map. Each site is free on a night with
+    probability `availability`; map availability codes are derived from the
+    sites below. Supports up to 899 parks, fanout 9 and 99 sites per map.
+    """
+
+    def __init__(self, parks: int = 2, depth: int = 2, fanout: int = 3, sites: int = 8,
+                 availability: float = 0.3, **kwargs):
+        super().__init__(**kwargs)
+        self.parks = [str(100 + park) for park in range(1, min(parks, 899) + 1)]
+        self.depth = depth
+        self.fanout = min(fanout, 9)
+        self.sites = min(sites, 99)
+        self.availability = availability
+        self.seed = kwargs.get('seed', 0)
+        self.site_free = {}
+        self.map_codes = {}
+
+    @staticmethod
+    def location_id(park_id) -> int:
+        return 1000 + int(park_id)
+
+    def children(self, map_id: str):
+        if self.level(map_id) >= self.depth:
+            return None
+        return [f"{map_id}{i}" for i in range(1, self.fanout + 1)]
+
+    @staticmethod
+    def level(map_id: str) -> int:
+        # park ids have three digits, every level below adds one
+        return len(map_id) - 3
+
+    def leaf_sites(self, map_id: str):
+        return [f"{map_id}{i:02d}" for i in range(1, self.sites + 1)]
+
+    def park_sites(self, park_id: str):
+        stack, sites = [park_id], []
+        while stack:
+            map_id = stack.pop()
+            children = self.children(map_id)
+            if children is None:
+                sites.extend(self.leaf_sites(map_id))
+            else:
+                stack.extend(children)
+        return sites
+
+    def daily(self, site_id: str, days: int):
+        rnd = random.Random(f"{self.seed}:{site_id}")
+        return [0 if rnd.random() < self.availability else 1 for _ in range(days)]
+
+    def free(self, site_id: str) -> bool:
+        # any free night in the first two weeks, cached since map codes recurse over it
+        if site_id not in self.site_free:
+            self.site_free[site_id] = 0 in self.daily(site_id, 14)
+        return self.site_free[site_id]
+
+    def map_code(self, map_id: str) -> int:
+        if map_id not in self.map_codes:
+            children = self.children(map_id)
+            if children is None:
+                free = any(self.free(site) for site in self.leaf_sites(map_id))
+            else:
+                free = any(self.map_code(child) == 0 for child in children)
+            self.map_codes[map_id] = 0 if free else 1
+        return self.map_codes[map_id]
+
+    def respond(self, method, url, params, data):
+        path = urlparse(url).path
+        params = dict(parse_qsl(urlparse(url).query), **(params or {}))
+
+        if path.endswith('/api/availability/map'):
+            map_id = str(params.get('mapId'))
+            if map_id[:3] not in self.parks or self.level(map_id) > self.depth:
+                return None
+            children = self.children(map_id)
+            if children is None:
+                return 200, {}, {
+                    "mapLinkAvailabilities": {},
+                    "resourceAvailabilities": {
+                        site: [{"availability": 0 if self.free(site) else 1, "remainingQuota": None}]
+                        for site in self.leaf_sites(map_id)
+                    },
+                }
+            return 200, {}, {
+                "mapLinkAvailabilities": {child: [self.map_code(child)] for child in children},
+                "resourceAvailabilities": {},
+            }
+
+        if path.endswith('/api/availability/resourcedailyavailability'):
+            try:
+                days = (date.fromisoformat(params['endDate'][:10]) - date.fromisoformat(params['startDate'][:10])).days
+            except (KeyError, ValueError):
+                days = 60
+            return 200, {}, [
+                {"availability": code, "remainingQuota": None}
+                for code in self.daily(str(params.get('resourceId')), max(days, 1))
+            ]
+
+        if path.endswith('/api/resourcelocation/resources'):
+            location_id = int(params.get('resourceLocationId', 0))
+            park_id = next((park for park in self.parks if self.location_id(park) == location_id), None)
+            if park_id is None:
+                return None
+            return 200, {"Cache-Control": "max-age=86400"}, {
+                site: {
+                    "resourceCategoryId": 1,
+                    "localizedValues": [{"name": site[-2:], "description": f"Synthetic site {site}"}],
+                    "maxCapacity": 6,
+                    "photos": [],
+                    "maxStay": 14,
+                    "definedAttributes": [],
+                }
+                for site in self.park_sites(park_id)
+            }
+
+        return None
+
+
+def create_app(backend: MockBackend) -> Flask:
+    app = Flask(__name__)
+
+    @app.route("/__mock__/stats", methods=["GET"])
+    def stats():
+        return jsonify(backend.stats)
+
+    @app.route("/", defaults={"path": ""}, methods=["GET", "POST"])
+    @app.route("/<path:path>", methods=["GET", "POST"])
+    def catch_all(path):
+        status, headers, body = backend.handle(
+            request.method,
+            request.path,
+            request.args.to_dict(),
+            request.get_data(as_text=True) or None,
+        )
+        if isinstance(body, str):
+            response = Response(body, status=status)
+        else:
+            response = jsonify(body)
+            response.status_code = status
+        for name, value in headers.items():
+            if name != "Content-Type":
+                response.headers[name] = value
+        return response
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recording', nargs='?', help='JSON lines file written by the scraper in record mode')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0, help='added to every response, in ms')
+    parser.add_argument('--jitter', type=float, default=0, help='random extra latency up to this many ms')
+    parser.add_argument('--rate', type=float, default=None, help='requests/sec before answering 429')
+    parser.add_argument('--burst', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0, help='seed of the latency jitter and synthetic data')
+
+    synthetic = parser.add_argument_group('synthetic backend')
+    synthetic.add_argument('--synthetic', action='store_true', help='serve generated parks instead of a recording')
+    synthetic.add_argument('--parks', type=int, default=2)
+    synthetic.add_argument('--depth', type=int, default=2)
+    synthetic.add_argument('--fanout', type=int, default=3)
+    synthetic.add_argument('--sites', type=int, default=8)
+    synthetic.add_argument('--availability', type=float, default=0.3, help='chance a site is free on a night')
+    args = parser.parse_args()
+
+    options = dict(latency=args.latency, jitter=args.jitter, rate=args.rate, burst=args.burst, seed=args.seed)
+    if args.synthetic:
+        backend = SyntheticBackend(args.parks, args.depth, args.fanout, args.sites, args.availability, **options)
+    elif args.recording:
+        responses = load_recording(args.recording)
+        print(f"Loaded {sum(len(entries) for entries in responses.values())} responses for {len(responses)} requests")
+        backend = Replay(responses, **options)
+    else:
+        parser.error('a recording or --synthetic is required')
+
+    create_app(backend).run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+import time
+import threading
+import traceback
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import metrics
+from ratelimit import backoff_delay
+
+# Outcome of a send to one token
+SENT = "sent"
+INVALID = "invalid"
+TRANSIENT = "transient"
+FAILED = "failed"
+
+# FCM accepts at most this many tokens per multicast
+MAX_MULTICAST = 500
+
+
+class FirebaseBackend:
+    """
+    Firebase Cloud Messaging through firebase_admin. The SDK is imported and the
+    app initialized from `credentials_file` on the first send.
+    """
+
+    def __init__(self, credentials_file: str = "serviceAccountKey.json"):
+        self.credentials_file = credentials_file
+        self.app = None
+        self.lock = threading.Lock()
+
+    def _initialize(self):
+        with self.lock:
+            if self.app is None:
+                import firebase_admin
+                from firebase_admin import credentials
+                try:
+                    self.app = firebase_admin.get_app()
+                except ValueError:
+                    self.app = firebase_admin.initialize_app(credentials.Certificate(self.credentials_file))
+            return self.app
+
+    def send_multicast(self, tokens: List[str], title: str, body: str, data: Dict[str, str]) -> List[str]:
+        """Send one notification to many tokens. Returns the outcome of each token, in order."""
+        from firebase_admin import exceptions, messaging
+
+        app = self._initialize()
+        message = messaging.MulticastMessage(
+            tokens=tokens,
+            notification=messaging.Notification(title=title, body=body),
+            data=data,
+        )
+        try:
+            response = messaging.send_each_for_multicast(message, app=app)
+        except (exceptions.UnavailableError, exceptions.InternalError, exceptions.DeadlineExceededError):
+            return [TRANSIENT] * len(tokens)
+
+        outcomes = []
+        for result in response.responses:
+            error = result.exception
+            if result.success:
+                outcomes.append(SENT)
+            elif isinstance(error, (messaging.UnregisteredError, messaging.SenderIdMismatchError,
+                                    exceptions.InvalidArgumentError)):
+                outcomes.append(INVALID)
+            elif isinstance(error, (messaging.QuotaExceededError, exceptions.UnavailableError,
+                                    exceptions.InternalError, exceptions.DeadlineExceededError)):
+                outcomes.append(TRANSIENT)
+            else:
+                print(f"Push failed: {error}")
+                outcomes.append(FAILED)
+        return outcomes
+
+
+class FakeBackend:
+    """
+    In-memory messaging backend for local runs and tests. Records every
+    multicast, rejects `invalid` tokens and fails the first `fail_times`
+    sends transiently.
+    """
+
+    def __init__(self, invalid: Iterable[str] = (), fail_times: int = 0):
+        self.invalid = set(invalid)
+        self.fail_times = fail_times
+        self.sent: List[Tuple[List[str], str, str, Dict[str, str]]] = []
+        self.lock = threading.Lock()
+
+    def send_multicast(self, tokens, title, body, data):
+        with self.lock:
+            if self.fail_times > 0:
+                self.fail_times -= 1
+                return [TRANSIENT] * len(tokens)
+            self.sent.append((list(tokens), title, body, data))
+        return [INVALID if token in self.invalid else SENT for token in tokens]
+
+
+class Notifier:
+    """
+    Background push queue.
+
+    Alerts for the same token arriving within `coalesce` seconds are merged into
+    one notification; tokens receiving the same notification are sent together
+    in multicasts of up to MAX_MULTICAST. Transient failures are retried with
+    exponential backoff, up to `retries` times; tokens the backend reports as
+    invalid are passed to `on_invalid` so they can be forgotten.
+    """
+
+    def __init__(self, backend, on_invalid: Optional[Callable[[str], None]] = None,
+                 coalesce: float = 2.0, retries: int = 3):
+        self.backend = backend
+        self.on_invalid = on_invalid
+        self.coalesce = coalesce
+        self.retries = retries
+
+        self.condition = threading.Condition()
+        # token -> [(time, title, body)] waiting to be coalesced
+        self.pending: Dict[str, List[Tuple[float, str, str]]] = {}
+        # [not_before, attempt, tokens, title, body] ready to send
+        self.deliveries: List[list] = []
+        self.busy = False
+        self.thread = None
+
+    def notify(self, tokens, title: str, body: str):
+        """Queue an alert for one token or a list of tokens. Returns immediately."""
+        if isinstance(tokens, str):
+            tokens = [tokens]
+        tokens = [token for token in dict.fromkeys(tokens or []) if token]
+        if not tokens:
+            print("No FCM token provided!")
+            return
+
+        now = time.time()
+        with self.condition:
+            for token in tokens:
+                self.pending.setdefault(token, []).append((now, title, body))
+            self._start()
+            self.condition.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Send everything queued now, skipping the coalescing delay. Returns False on timeout."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            self._coalesce(force=True)
+            self.condition.notify_all()
+            while self.pending or self.deliveries or self.busy:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def _start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._loop, name="notifier", daemon=True)
+            self.thread.start()
+
+    def _coalesce(self, force: bool = False):
+        """Turn pending alerts older than the coalescing delay into deliveries. Call with the lock held."""
+        now = time.time()
+        ready = {}
+        for token, alerts in list(self.pending.items()):
+            if force or now - alerts[0][0] >= self.coalesce:
+                ready[token] = alerts
+                del self.pending[token]
+
+        groups = {}
+        for token, alerts in ready.items():
+            _, title, body = alerts[-1]
+            if len(alerts) > 1:
+                body = "\n".join(alert_body.strip() for _, _, alert_body in alerts)
+                title = f"{title} (+{len(alerts) - 1} more)"
+            groups.setdefault((title, body), []).append(token)
+
+        for (title, body), tokens in groups.items():
+            for start in range(0, len(tokens), MAX_MULTICAST):
+                self.deliveries.append([now, 0, tokens[start:start + MAX_MULTICAST], title, body])
+
+    def _next_wakeup(self) -> Optional[float]:
+        times = [delivery[0] for delivery in self.deliveries]
+        times.extend(alerts[0][0] + self.coalesce for alerts in self.pending.values())
+        return min(times) if times else None
+
+    def _loop(self):
+        while True:
+            with self.condition:
+                self._coalesce()
+                now = time.time()
+                due = [delivery for delivery in self.deliveries if delivery[0] <= now]
+                if not due:
+                    wakeup = self._next_wakeup()
+                    self.condition.wait(None if wakeup is None else max(wakeup - now, 0.01))
+                    continue
+                self.deliveries = [delivery for delivery in self.deliveries if delivery[0] > now]
+                self.busy = True
+
+            try:
+                for delivery in due:
+                    self._send(*delivery[1:])
+            finally:
+                with self.condition:
+                    self.busy = False
+                    self.condition.notify_all()
+
+    def _send(self, attempt: int, tokens: List[str], title: str, body: str):
+        data = {
+            "title": str(title),
+            "body": str(body),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "unread": "true",
+        }
+        try:
+            outcomes = self.backend.send_multicast(tokens, title, body, data)
+        except Exception:
+            traceback.print_exc()
+            outcomes = [TRANSIENT] * len(tokens)
+
+        retry = []
+        for token, outcome in zip(tokens, outcomes):
+            metrics.PUSHES.inc(result=outcome)
+            if outcome == INVALID:
+                print(f"Dropping invalid FCM token {token[:12]}...")
+                if self.on_invalid is not None:
+                    self.on_invalid(token)
+            elif outcome == TRANSIENT:
+                retry.append(token)
+        print(f"Push sent to {outcomes.count(SENT)} of {len(tokens)} devices")
+
+        if retry:
+            if attempt >= self.retries:
+                print(f"Gave up pushing to {len(retry)} devices after {attempt + 1} attempts")
+                return
+            with self.condition:
+                self.deliveries.append([time.time() + backoff_delay(attempt), attempt + 1, retry, title, body])
+                self.condition.notify_all()
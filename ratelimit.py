@@ -0,0 +1,108 @@
+import time
+import random
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+
+def parse_retry_after(value) -> Optional[float]:
+    """
+    Convert a Retry-After header (delta-seconds or HTTP date) into seconds to wait.
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """
+    Exponential backoff with full jitter for the given retry attempt (0-based).
+    """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by every request of a scraper.
+
+    `rate` tokens are added per second up to `burst`. Throttling responses
+    halve the current rate (down to `min_rate`) and pause the bucket; each
+    successful call then grows the rate back towards the configured one.
+    """
+
+    def __init__(self, rate: float = 2.0, burst: int = 4, min_rate: float = 0.2):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.burst = max(int(burst), 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """
+        Block until a token is available, then take it.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.blocked_until:
+                    self._refill(now)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    wait = self.blocked_until - now
+            time.sleep(wait)
+
+    def try_acquire(self) -> float:
+        """
+        Take a token without blocking. Returns 0 on success, otherwise the seconds until one is available.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def penalize(self, retry_after: Optional[float] = None):
+        """
+        Slow down after a 429/503: halve the rate and pause for `retry_after` seconds.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = max(self.rate / 2, self.min_rate)
+            self.tokens = 0.0
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+
+    def reward(self):
+        """
+        Recover additively towards the configured rate after a successful call.
+        """
+        with self.lock:
+            if self.rate < self.max_rate:
+                self._refill(time.monotonic())
+                self.rate = min(self.rate + self.max_rate / 10, self.max_rate)
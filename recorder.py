@@ -0,0 +1,97 @@
+import json
+import threading
+from datetime import date
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+# Parameters that change on every call (request seeds, timestamps) and are left out of replay keys
+VOLATILE_PARAMS = ('seed', 'searchTime')
+
+# Date parameters, keyed as day offsets from the day of the request so a recording replays on later days
+DATE_PARAMS = ('startDate', 'endDate')
+
+# Response headers worth keeping in a recording
+RECORDED_HEADERS = ('Content-Type', 'Retry-After', 'ETag', 'Last-Modified', 'Cache-Control')
+
+
+def day_offset(value: str, today: date) -> str:
+    """"YYYY-MM-DD" as a signed day offset from `today` ("+3"), other values unchanged."""
+    try:
+        return f"{(date.fromisoformat(value) - today).days:+d}"
+    except ValueError:
+        return value
+
+
+def request_key(method: str, url: str, params: Optional[Dict[str, Any]] = None, data: Any = None,
+                today: Optional[date] = None) -> str:
+    """
+    Replay key of a request: method, path and sorted non-volatile query parameters
+    (from both the URL and `params`), plus the body of POST requests. Dates are
+    relative to `today` (the current day if None).
+    """
+    if today is None:
+        today = date.today()
+    parsed = urlparse(url)
+    query = parse_qsl(parsed.query, keep_blank_values=True)
+    # requests drops None parameters from the query string
+    query.extend((name, str(value)) for name, value in (params or {}).items() if value is not None)
+    query = sorted(
+        (name, day_offset(value, today) if name in DATE_PARAMS else value)
+        for name, value in query if name not in VOLATILE_PARAMS
+    )
+
+    key = f"{method.upper()} {parsed.path}"
+    if query:
+        key = f"{key}?{urlencode(query)}"
+    if data:
+        key = f"{key} {data if isinstance(data, str) else json.dumps(data, sort_keys=True)}"
+    return key
+
+
+class Recorder:
+    """
+    Appends every request/response pair to a JSON lines file, one object per line:
+    {"key", "method", "url", "params", "status", "headers", "body"}.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def record(self, method: str, url: str, params, data, response, today: Optional[date] = None):
+        """Append one request/response pair; dates in the key are relative to `today` (the scraper's day)."""
+        try:
+            body = response.json()
+        except ValueError:
+            body = response.text
+
+        entry = {
+            "key": request_key(method, url, params, data, today),
+            "method": method,
+            "url": url,
+            "params": params,
+            "status": response.status_code,
+            "headers": {name: response.headers[name] for name in RECORDED_HEADERS if name in response.headers},
+            "body": body,
+        }
+        line = json.dumps(entry, separators=(',', ':'), default=str)
+        with self.lock:
+            with open(self.path, "a", encoding="utf-8") as fp:
+                fp.write(line + "\n")
+            self.count += 1
+
+
+def load_recording(path: str) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Read a recording into {key: [responses in recorded order]}.
+    """
+    responses = {}
+    with open(path, encoding="utf-8") as fp:
+        for line in fp:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            responses.setdefault(entry['key'], []).append(entry)
+    return responses
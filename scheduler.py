@@ -0,0 +1,200 @@
+import time
+import random
+import threading
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import metrics
+
+
+class CrawlCancelled(Exception):
+    """Raised inside a run when the scheduler cancels it."""
+
+
+class Job:
+    """
+    A set of parks crawled every `interval` minutes (`parks` None means all configured parks).
+    `scheduled` is the fixed-rate slot, `next_run` the same slot with jitter applied.
+    """
+
+    def __init__(self, name: str, interval: float, parks: Optional[List[str]] = None):
+        self.name = name
+        self.interval = float(interval)
+        self.parks = parks
+        self.scheduled = time.time()
+        self.next_run = self.scheduled
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "parks": self.parks,
+            "interval": self.interval,
+            "next_run": datetime.fromtimestamp(self.next_run).strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+
+class Scheduler:
+    """
+    Fixed-rate scheduler running jobs one at a time on a single worker thread.
+
+    Each job is due every `interval` minutes from its previous *scheduled* time
+    (plus up to `jitter` seconds), so a slow crawl does not push later runs back;
+    slots missed while a crawl overran are skipped and counted, not queued up.
+    `run_now` triggers a job immediately and `cancel` stops the current run
+    through the `cancel_event` the target checks.
+    """
+
+    def __init__(self, target: Callable[[Optional[List[str]]], Optional[Dict[str, Any]]], jobs: List[Job],
+                 jitter: float = 0, history_size: int = 100):
+        self.target = target
+        self.jobs = jobs
+        self.jitter = jitter
+        self.history = deque(maxlen=history_size)
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.cancel_event = threading.Event()
+        self.stopping = False
+        self.pending = []
+        self.current = None
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            # a thread still finishing after a non-blocking stop() keeps going
+            self.stopping = False
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.thread = threading.Thread(target=self._loop, name="scheduler", daemon=True)
+            self.thread.start()
+
+    def stop(self, wait: bool = False):
+        """Stop scheduling and cancel the current run. Does not block unless `wait`."""
+        with self.lock:
+            self.stopping = True
+            thread = self.thread
+        self.cancel_event.set()
+        self.wakeup.set()
+        if wait and thread is not None:
+            thread.join()
+
+    def set_jobs(self, jobs: List[Job]):
+        """Replace the jobs, keeping the next run time of jobs that keep their name."""
+        with self.lock:
+            previous = {job.name: job for job in self.jobs}
+            for job in jobs:
+                if job.name in previous:
+                    job.scheduled = previous[job.name].scheduled
+                    job.next_run = previous[job.name].next_run
+            self.jobs = jobs
+        self.wakeup.set()
+
+    def run_now(self, name: Optional[str] = None) -> bool:
+        """Queue job `name` (the first job if None) to run as soon as the worker is free."""
+        job = self._job(name)
+        if job is None:
+            return False
+        with self.lock:
+            if job not in self.pending:
+                self.pending.append(job)
+        self.wakeup.set()
+        return True
+
+    def cancel(self) -> bool:
+        """Cancel the run in progress, if any."""
+        with self.lock:
+            if self.current is None:
+                return False
+        self.cancel_event.set()
+        return True
+
+    def status(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "running": None if self.current is None else self.current['job'],
+                "jobs": [job.as_dict() for job in self.jobs],
+                "history": list(self.history),
+            }
+
+    def _job(self, name: Optional[str]) -> Optional[Job]:
+        if name is None:
+            return self.jobs[0] if self.jobs else None
+        return next((job for job in self.jobs if job.name == name), None)
+
+    def _next_job(self):
+        with self.lock:
+            if self.pending:
+                return self.pending.pop(0), True
+        if not self.jobs:
+            return None, False
+        return min(self.jobs, key=lambda job: job.next_run), False
+
+    def _loop(self):
+        while True:
+            with self.lock:
+                if self.stopping:
+                    return
+
+            job, forced = self._next_job()
+            if job is None:
+                self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+
+            delay = job.next_run - time.time()
+            if not forced and delay > 0:
+                # sleep until due, waking up early for run_now / stop
+                self.wakeup.wait(delay)
+                self.wakeup.clear()
+                continue
+
+            self._execute(job)
+            if not forced:
+                self._reschedule(job)
+
+    def _reschedule(self, job: Job):
+        period = job.interval * 60
+        job.scheduled += period
+        skipped = 0
+        now = time.time()
+        while job.scheduled <= now:
+            job.scheduled += period
+            skipped += 1
+        job.next_run = job.scheduled
+        if self.jitter:
+            job.next_run += random.uniform(0, self.jitter)
+        if skipped and self.history:
+            self.history[-1]['skipped'] = skipped
+            print(f"Job {job.name} overran its interval, skipped {skipped} runs")
+
+    def _execute(self, job: Job):
+        self.cancel_event.clear()
+        record = {
+            "job": job.name,
+            "parks": job.parks,
+            "start": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "duration": None,
+            "status": "running",
+        }
+        with self.lock:
+            self.current = record
+
+        started = time.time()
+        try:
+            stats = self.target(job.parks) or {}
+            record.update(stats)
+            record['status'] = "ok"
+        except CrawlCancelled:
+            record['status'] = "cancelled"
+        except Exception as e:
+            traceback.print_exc()
+            record['status'] = f"error: {e}"
+        record['duration'] = round(time.time() - started, 2)
+        metrics.RUN_SECONDS.observe(time.time() - started)
+        metrics.RUNS.inc(status=record['status'].split(':')[0])
+
+        with self.lock:
+            self.current = None
+            self.history.append(record)
@@ -1,38 +1,46 @@
 import os
+import sys
 import time
 import json
-import requests
 import uuid
+import subprocess
 from datetime import date, datetime, timedelta, timezone
-from dotenv import load_dotenv, set_key
 import threading
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from urllib.parse import urlparse
 
-from selenium import webdriver
-# from seleniumwire import webdriver  # Note the change
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.by import By
-from webdriver_manager.chrome import ChromeDriverManager
-
-import firebase_admin
-from firebase_admin import credentials, messaging
+# requests, numpy (windows, history) and firebase_admin are imported on first use,
+# so that importing this module and creating a Scraper stay cheap for server.py
 from store import Store
+from ratelimit import TokenBucket, backoff_delay, parse_retry_after
+from httpcache import ResponseCache
+from attributes import AttributeDecoder
+from changes import diff_results, carry_over_cart_flags, window_keys
+from events import EventBus
+from scheduler import Scheduler, Job, CrawlCancelled
+from recorder import Recorder
+import metrics
+from tracing import Tracer, NULL_TRACER
+from notify import Notifier, FirebaseBackend
+from checkpoint import CrawlCheckpoint, checkpoint_key, DONE as CHECKPOINT_DONE
 
 DEBUG = True
 
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Responses that mean the server wants us to slow down
+THROTTLE_STATUS_CODES = (429, 503)
+
+# Map-level availability codes worth descending into (available / partly available)
+BOOKABLE_MAP_CODES = (0, 3, 7)
+
+# Daily availability responses handed to the window finder at once
+WINDOW_BATCH_SIZE = 64
+
 def _debug_print(*args, **kwargs):
     if DEBUG:
         print(*args, **kwargs)
 
-# Function to get localized display name
-def get_localized_display_name(localized_values, culture_name):
-    for value in localized_values:
-        if value['cultureName'] == culture_name:
-            return value['displayName']
-    return None
-
 class Scraper:
     def __init__(self):
         # initialize
@@ -41,11 +49,56 @@ class Scraper:
         # Initialize task scheduler
         self.lock = threading.Lock()
         self.is_running = False
-        self.process = None
+        self.scheduler = Scheduler(self.run, self._make_jobs_(), jitter=self.store.get('jitter') or 0)
+        self.cancel_event = self.scheduler.cancel_event
+
+        # Shared state for concurrent crawling
+        self.result_lock = threading.Lock()
+        self.host_slots = {}
+        self.revalidating = set()
+        self.root_parks = {}
+        self.root_finished = {}
+
+        # Per-run span recorder, a real Tracer when the `trace` setting names a directory
+        self.tracer = NULL_TRACER
+
+        # Shared request rate limiter, adapts to throttling responses
+        self.limiter = TokenBucket(
+            rate=self.store.get('rate') or 2,
+            burst=self.store.get('burst') or 4,
+        )
+
+        # Live results for /api/stream listeners
+        self.events = EventBus()
+
+        # Cache for static reservation endpoints
+        self.cache = ResponseCache(self.store, self.store.get('cache_ttl'))
+
+        # Daily availability snapshots of every run, see the `history` property
+        self._history = None
 
-        # Initialize Firebase Cloud Messaging
-        cred = credentials.Certificate("serviceAccountKey.json")
-        firebase_admin.initialize_app(cred)
+        # Request/response capture for mockserver.py, enabled by the `record` setting (a file path)
+        self.recorder = Recorder(self.store.get('record')) if self.store.get('record') else None
+
+        # Push alerts are sent from a background queue, invalid tokens are forgotten.
+        # Firebase Cloud Messaging is initialized with the first push.
+        self.notifier = Notifier(
+            FirebaseBackend("serviceAccountKey.json"),
+            on_invalid=self.store.remove_token,
+            coalesce=self.store.get('push_coalesce') or 2,
+        )
+
+    @property
+    def history(self):
+        """
+        Availability history store, opened on first use (it loads numpy).
+        """
+        if self._history is None:
+            with self.lock:
+                if self._history is None:
+                    from history import AvailabilityHistory
+                    self._history = AvailabilityHistory(self.store)
+        return self._history
 
     def date2str(self, days_from_today: int) -> str:
         """
@@ -55,7 +108,14 @@ class Scraper:
         return target_date.strftime("%Y-%m-%d")
 
     def _init_session_(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+
         # Initialize Selenium Web Driver
+        # from selenium import webdriver
+        # from selenium.webdriver.chrome.options import Options
+        # from selenium.webdriver.chrome.service import Service
+        # from webdriver_manager.chrome import ChromeDriverManager
         # options = Options()
         # # options.add_argument("--headless")
         # self.driver = webdriver.Chrome(
@@ -68,10 +128,19 @@ class Scraper:
         #     "return localStorage.getItem('cartUid');"
         # )
 
+        if getattr(self, 'session', None) is not None:
+            # left open by a cancelled run
+            self.session.close()
+
         self.api_calls = 0
         self.today = date.today()
-        self.attribute_data = self.store.load('attributes')
         self.session = requests.Session()
+
+        # Keep enough pooled connections open for the concurrent crawl
+        pool_size = max(self.concurrency(), 10)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         self.headers = {
             "Accept": "application/json",
             "Accept-Encoding": "gzip, deflate",
@@ -98,7 +167,29 @@ class Scraper:
         # self.driver.quit()
         self.session.close()
 
-    def _make_param_(self, mapId, startDate, endDate):
+    def concurrency(self) -> int:
+        """
+        Number of map requests allowed in flight per host. 1 means the serial crawl.
+        """
+        return max(int(self.store.get('concurrency') or 1), 1)
+
+    def shards(self) -> int:
+        """
+        Number of worker processes crawling each run, 0 to crawl in this process.
+        """
+        return max(int(self.store.get('shards') or 0), 0)
+
+    def _host_slot_(self, url):
+        """
+        Semaphore capping the number of concurrent requests sent to the host of `url`.
+        """
+        host = urlparse(url).netloc
+        with self.result_lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.BoundedSemaphore(self.concurrency())
+            return self.host_slots[host]
+
+    def _make_param_(self, mapId, startDate, endDate, equipment=None):
 
         utc_time = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
         
@@ -106,7 +197,7 @@ class Scraper:
             "mapId": mapId,
             "bookingCategoryId": 0,
             "equipmentCategoryId": -32768,
-            "subEquipmentCategoryId": self.store.get('equipment'),
+            "subEquipmentCategoryId": equipment or self.store.get('equipment'),
             # "cartUid": self.cart_uid,  # Update with current session value
             # "cartTransactionUid": self.cart_transaction_uid,  # Update with current session value
             # "bookingUid": "12f47a1c-f930-49f6-b5e5-8958dda7a9ee",  # Update with current session value
@@ -143,41 +234,102 @@ class Scraper:
             "seed": utc_time
         }
 
-    def _request_(self, methods: str, url: str, headers=None, params=None, data=None):
+    def _request_(self, methods: str, url: str, headers=None, params=None, data=None, session=None):
         """
-        Make a simple GET request to the specified URL.
+        Make a rate limited request to the specified URL.
+        Throttled (429/503) and failed requests are retried with exponential backoff.
+        GET requests to static endpoints are answered from the response cache.
+        In record mode every response that reaches the network is appended to the recording.
         """
 
-        time.sleep(1)
-
         if headers is None:
             headers = self.headers
-        try:
-            if methods == "GET":
-                response = self.session.get(url, headers=headers, params=params)
-            elif methods == "POST":
-                response = self.session.post(url, headers=headers, params=params, data=data)
-            else:
-                _debug_print(f"Unsupported method: {methods}")
-                return None
-        except Exception as e:
-            _debug_print(f"Request error: {e}")
+        if session is None:
+            session = self.session
+        if methods not in ("GET", "POST"):
+            _debug_print(f"Unsupported method: {methods}")
             return None
-            
-        self.api_calls += 1
-        _debug_print(f"API Call #{self.api_calls} responses with status code {response.status_code}")
 
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return None
+        endpoint = urlparse(url).path
+        ttl = self.cache.ttl(url) if methods == "GET" else None
+        cached = None
+        if ttl:
+            cached, fresh = self.cache.lookup(url, params, ttl)
+            if fresh:
+                metrics.CACHE.inc(result="hit")
+                self.tracer.annotate(cache="hit")
+                return cached['body']
+            metrics.CACHE.inc(result="miss")
+            headers = dict(headers, **self.cache.conditional_headers(cached))
+
+        retries = self.store.get('retries')
+        retries = 3 if retries is None else retries
+
+        for attempt in range(retries + 1):
+            self.limiter.acquire()
+            started = time.perf_counter()
+            try:
+                with self._host_slot_(url):
+                    if methods == "GET":
+                        response = session.get(url, headers=headers, params=params)
+                    else:
+                        response = session.post(url, headers=headers, params=params, data=data)
+            except Exception as e:
+                _debug_print(f"Request error: {e}")
+                metrics.REQUESTS.inc(endpoint=endpoint, status="error")
+                if attempt < retries:
+                    metrics.RETRIES.inc(endpoint=endpoint, reason="error")
+                    time.sleep(backoff_delay(attempt))
+                    continue
+                return None
 
-    def api_check(self, start: int, end: int, mapId=None):
+            metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+            metrics.REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+            if self.tracer.enabled:
+                self.tracer.annotate(status=response.status_code, bytes=len(response.content), attempts=attempt + 1)
+
+            with self.result_lock:
+                self.api_calls += 1
+                api_calls = self.api_calls
+            _debug_print(f"API Call #{api_calls} responses with status code {response.status_code}")
+
+            if self.recorder is not None:
+                self.recorder.record(methods, url, params, data, response, self.today)
+
+            if response.status_code in THROTTLE_STATUS_CODES:
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                self.limiter.penalize(retry_after)
+                if attempt < retries:
+                    metrics.RETRIES.inc(endpoint=endpoint, reason="throttled")
+                    # the limiter already holds every thread until Retry-After
+                    if retry_after is None:
+                        time.sleep(backoff_delay(attempt))
+                    continue
+                print(f"Gave up after {attempt + 1} throttled attempts: {url}")
+                return None
+
+            self.limiter.reward()
+
+            if response.status_code == 304 and cached is not None:
+                metrics.CACHE.inc(result="revalidated")
+                return self.cache.refresh(url, params, cached)
+
+            if response.status_code == 200:
+                body = response.json()
+                if ttl:
+                    self.cache.put(url, params, body, response.headers)
+                return body
+            else:
+                return None
+
+    def api_check(self, start: int, end: int, mapId=None, session=None, equipment=None):
         """ Check availability for a given date range and map ID.
         Args:
             start (int): Start date offset in days from today.
             end (int): End date offset in days from today.
             mapId (str, optional): Map ID to check availability for. Defaults to None.\
+            session (requests.Session, optional): Session to use instead of the crawl session.
+            equipment (str, optional): Sub-equipment category, defaults to the `equipment` setting.
         Returns:
             bool: True if availability is found, False otherwise.
         """
@@ -190,7 +342,8 @@ class Scraper:
         response = self._request_(
             methods="GET",
             url=f"{self.store.get('url')}/api/availability/map",
-            params=self._make_param_(mapId, startDate, endDate)
+            params=self._make_param_(mapId, startDate, endDate, equipment),
+            session=session
         )
 
         return response
@@ -200,8 +353,11 @@ class Scraper:
         if map_id == "-2147483403" or map_id == -2147483403: # ignore Jasper Overflow
             return False
 
-        if map_id is None:
+        # the root call collects every new resource and writes them in one batch
+        is_root = map_id is None
+        if is_root:
             map_id = park_id
+            self.pending_resources = {}
 
         if resourceLocationId is None:
             resourceLocationId = self.store.find_location_id(map_id)
@@ -217,7 +373,7 @@ class Scraper:
             resourceAvailabilities = response.get('resourceAvailabilities')
 
             if resourceAvailabilities:
-                resources = self._request_("GET", f"https://reservation.pc.gc.ca/api/resourcelocation/resources?resourceLocationId={resourceLocationId}")
+                resources = self._request_("GET", f"{self.store.get('url')}/api/resourcelocation/resources?resourceLocationId={resourceLocationId}")
                 print(f"resourceLocationId = {resourceLocationId}")
 
                 for id in resourceAvailabilities.keys():
@@ -225,14 +381,16 @@ class Scraper:
                         print(f"Not Found resource {id}")
                         continue
                     
-                    row = self.store.fetch_one('resource_map', 'id = ?', (id,))
+                    row = self.store.lookup('resource_map', id)
                     if row : 
                         print(f"Resource Already exist {id} - {row['park_id']} <> {park_id}")
                         continue
+                    if int(id) in self.pending_resources:
+                        continue
 
                     value = resources.get(id)
-                    category = self.store.fetch_one('category', 'id = ?', (value['resourceCategoryId'],))['name']
-                    self.store.insert('resource_map', {
+                    category = self.store.lookup('category', value['resourceCategoryId'])['name']
+                    self.pending_resources[int(id)] = {
                         "id"   : int(id),
                         'park_id' : park_id,
                         'map_id' : map_id,
@@ -243,7 +401,7 @@ class Scraper:
                         'capacity' : value['maxCapacity'],
                         'photos' : json.dumps(value['photos']),
                         'max_stay' : value['maxStay']
-                    })
+                    }
             else :
                 for child_map_id in mapLinkAvailabilities.keys():
                         self.dfs(park_id, child_map_id, resourceLocationId)
@@ -251,7 +409,20 @@ class Scraper:
         except Exception as e:
             _debug_print(f"Fast-Check-Error {e}")
 
-    def update_attributes(self):
+        if is_root and self.pending_resources:
+            inserted = self.store.insert_many('resource_map', list(self.pending_resources.values()))
+            print(f"Inserted {inserted} resources of park #{park_id}")
+
+    def update_attributes(self, culture_name="en-CA"):
+        """
+        Decode every resource's attributes into `resource_map.attr`.
+        Args:
+            culture_name: Culture of the display names ("en-CA" or "fr-CA").
+        """
+        decoder = AttributeDecoder.load()
+        if decoder is None:
+            return
+
         self._init_session_()
 
         # resource_location_list = self.store.fetch_all('location')
@@ -263,82 +434,36 @@ class Scraper:
 
             print(f"Resource Location #{resourceLocationId} is processing...")
 
-            resource_list = self._request_("GET", f"https://reservation.pc.gc.ca/api/resourcelocation/resources?resourceLocationId={resourceLocationId}")
+            resource_list = self._request_("GET", f"{self.store.get('url')}/api/resourcelocation/resources?resourceLocationId={resourceLocationId}")
 
             if not resource_list:
                 print(f"Resource Location #{resourceLocationId} could not resolve...")
                 continue
 
             # Example: Mapping attributes
+            updates = []
             for resource_id, resource_data in resource_list.items():
+                attributes_list = decoder.decode(resource_data['definedAttributes'], culture_name)
+                updates.append(({"attr" : json.dumps(attributes_list).encode('utf-8')}, (resource_id,)))
 
-                # List to store attribute names and values
-                attributes_list = []
-
-                # Culture to display names (change as needed)
-                culture_name = "en-CA"
-
-                # Iterate over defined attributes to extract names and values
-                for attr in resource_data['definedAttributes']:
-                    attribute_definition_id = attr['attributeDefinitionId']
-                    
-                    
-                    # Find corresponding attribute in attribute_json
-                    if str(attribute_definition_id) not in self.attribute_data:
-                        continue
-
-                    attribute_details = self.attribute_data[str(attribute_definition_id)]
-                    
-                    # Get the display name for the attribute
-                    attribute_name = get_localized_display_name(attribute_details['localizedValues'], culture_name)
-                    
-                    if attribute_details.get('values'):
-                        # Get the values for the attribute
-                        values = []
-                        attribute_defined_values = attr.get('values', [])
-                        for i in attribute_defined_values:
-                            value = None
-                            for t in attribute_details['values']:
-                                if str(t['enumValue']) == str(i):
-                                    value = t
-                                    break
-                            if value is None:
-                                continue
-
-                            value_name = get_localized_display_name(value['localizedValues'], culture_name)
-                            values.append(value_name)
-                        
-                        # Append to the attributes list
-                        attributes_list.append({
-                            "attribute": attribute_name,
-                            "value": ', '.join(values)
-                        })
-                    else :
-                        attributes_list.append({
-                            "attribute": attribute_name,
-                            "value": f"[Min : {attribute_details['minValue']} - Max : {attribute_details['maxValue']}]"
-                        })
-                
-                updated = self.store.update_row('resource_map', {"attr" : json.dumps(attributes_list).encode('utf-8')}, 'id = ?', (resource_id,))
-                if updated :
-                    total_changed += 1
+            updated = self.store.update_many('resource_map', updates, 'id = ?')
+            if updated :
+                total_changed += updated
         print(f"Total Changed : {total_changed}")
 
         self._del_session_()
 
-    def find_availability(self, start , end , resourceId):
-        """Finds available slots for a resource within a date range.
+    def daily_availability(self, start, end, resourceId, equipment=None):
+        """Fetch the per-day availability list of a resource within a date range.
         Args:
-            start: Start date of the search range.
-            end: End date of the search range.
+            start: Start date offset in days from today.
+            end: End date offset in days from today.
             resourceId: ID of the resource to check.
-            
+            equipment: Sub-equipment category, defaults to the `equipment` setting.
+
         Returns:
-            A tuple of (start_index, end_index) if a suitable slot is found, else None.
+            The list of daily availability dicts, or None on error.
         """
-        # Constants (should be defined at class level)
-        MIN_BLOCKS = self.store.get('blocks')
-        DEFAULT_MAX_RANGE = 123456
         url = f"{self.store.get('url')}/api/availability/resourcedailyavailability"
         params = {
             # "cartUid": self.cart_uid,
@@ -348,7 +473,7 @@ class Scraper:
             "endDate"   : self.date2str(end),
             "isReserving" :  True,
             "equipmentCategoryId" : -32768, 
-            "subEquipmentCategoryId" :  -32759,
+            "subEquipmentCategoryId" :  equipment or self.store.get('equipment'),
             "boatLength" : 0,
             "boatDraft" : 0,
             "boatWidth" : 0,
@@ -369,104 +494,778 @@ class Scraper:
         }
 
         try:
-            response = self._request_("GET", url, params=params)
-            # Debugging output
-            with open("test.json", "w") as f:
-                json.dump(response, f, indent=4)
+            with self.tracer.span("daily", "availability", resource_id=resourceId) as span:
+                response = self._request_("GET", url, params=params)
+                span['outcome'] = "error" if response is None else "ok"
+                return response
         except Exception as e:  # Replace with specific exception
             _debug_print(f"Failed to check availability for resource #{resourceId}: {str(e)}")
             return None
 
-        if not response:
-            return None
+    def find_windows(self, responses, max_nights=None, min_nights=None):
+        """Finds every long enough run of available days for many daily availability lists at once.
+        Args:
+            responses: daily availability lists, one per resource.
+            max_nights: longest stay, one value or one per resource (None for no limit).
+            min_nights: shortest stay, defaults to the `nights` setting.
+
+        Returns:
+            For each response, the list of (start_index, end_index) windows.
+        """
+        import windows
 
-        found_start, found_end = DEFAULT_MAX_RANGE, 0
-        min_required_range = min(MIN_BLOCKS, 6)  # Use consistent minimum range
+        min_nights = min_nights or self.store.get('nights') or 1
+        return windows.find_windows(windows.pack(responses), min_nights, max_nights)
 
-        for i, day_data in enumerate(response):
-            if not isinstance(day_data, dict):
-                continue
-                
-            available = day_data.get('availability', -1)  # Default to unavailable
-            if available == 0:
-                found_start = min(found_start, i)
-                found_end = max(found_end, i + 1)
-            else:
-                if found_end - found_start >= min_required_range:
-                    return found_start, found_end
-                found_start, found_end = DEFAULT_MAX_RANGE, 0
-
-        # Final check
-        if found_end - found_start >= min_required_range:
-            return found_start, found_end
-        return None
-
-    def send_push(self, title, body):
-        fcm_token = self.store.get('token')
-        if not fcm_token:
-            print("No FCM token provided!")
-            return
+    def find_window(self, response):
+        """Finds the first long enough run of available days in a daily availability list.
+        Returns:
+            A tuple of (start_index, end_index) if a suitable slot is found, else None.
+        """
+        found = self.find_windows([response])[0]
+        return found[0] if found else None
+
+    def find_availability(self, start , end , resourceId):
+        """Finds available slots for a resource within a date range.
+        Args:
+            start: Start date of the search range.
+            end: End date of the search range.
+            resourceId: ID of the resource to check.
+            
+        Returns:
+            A tuple of (start_index, end_index) if a suitable slot is found, else None.
+        """
+        return self.find_window(self.daily_availability(start, end, resourceId))
+
+    def fetch_daily(self, resources, days, equipment=None, on_batch=None, checkpoint=None):
+        """Fetch daily availability for many resources in parallel.
+        Args:
+            resources: resource_map rows to check.
+            days: Number of days from today to search.
+            equipment: Sub-equipment category, defaults to the `equipment` setting.
+            on_batch: optional callback([(index, response), ...]) called with every
+                WINDOW_BATCH_SIZE responses as they arrive, and once with the rest.
+            checkpoint: optional CrawlCheckpoint; responses it saved before a restart
+                are not fetched again, new ones are saved batch by batch.
+
+        Returns:
+            The daily availability responses, in the order of `resources`.
+        """
+        responses = [None] * len(resources)
+        batch = []
+
+        def save():
+            if batch and checkpoint is not None:
+                checkpoint.save_responses({
+                    resources[index]['id'] : response for index, response in batch
+                    if response is not None and index not in restored
+                })
+
+        def flush():
+            save()
+            if batch and on_batch is not None:
+                on_batch(list(batch))
+            batch.clear()
+
+        restored = set()
+        if checkpoint is not None:
+            saved = checkpoint.responses()
+            for index, resource in enumerate(resources):
+                if int(resource['id']) in saved:
+                    responses[index] = saved[int(resource['id'])]
+                    restored.add(index)
+                    batch.append((index, responses[index]))
+            if restored:
+                _debug_print(f"Resuming daily availability: {len(restored)} of {len(resources)} sites already fetched")
+            flush()
+
+        executor = ThreadPoolExecutor(max_workers=self.concurrency())
         try:
-            message = messaging.Message(
-                notification=messaging.Notification(title=title, body=body),
-                token=fcm_token,
-                data={
-                    "title": str(title),
-                    "body": str(body),
-                    "timestamp": datetime.now(timezone.utc).isoformat(),
-                    "unread": "true",
-                },
+            futures = {
+                executor.submit(self.daily_availability, 0, days, resource['id'], equipment) : index
+                for index, resource in enumerate(resources) if index not in restored
+            }
+            for future in as_completed(futures):
+                self._check_cancelled_()
+                index = futures[future]
+                responses[index] = future.result()
+                batch.append((index, responses[index]))
+                if len(batch) >= WINDOW_BATCH_SIZE:
+                    flush()
+        except BaseException:
+            # keep what arrived for the run resuming this one
+            save()
+            raise
+        finally:
+            # drops the queued requests when the run is cancelled
+            executor.shutdown(wait=True, cancel_futures=True)
+        flush()
+
+        return responses
+
+    def find_availabilities(self, resources, days, on_found=None, equipment=None, min_nights=None):
+        """Fetch daily availability for many resources in parallel.
+        Responses are handed to the window finder in batches as they arrive.
+        Args:
+            resources: resource_map rows to check.
+            days: Number of days from today to search.
+            on_found: optional callback(resource, windows) called as soon as a batch yields windows.
+            equipment: Sub-equipment category, defaults to the `equipment` setting.
+            min_nights: shortest stay, defaults to the `nights` setting.
+
+        Returns:
+            A list of (resource, windows) in the order of `resources`, where windows
+            is every (start_index, end_index) stay found for that resource.
+        """
+        found_windows = [None] * len(resources)
+
+        def on_batch(batch):
+            indexes = [index for index, _ in batch]
+            results = self.find_windows(
+                [response for _, response in batch],
+                [resources[index].get('max_stay') for index in indexes],
+                min_nights
             )
-            print(f"FCM_TOKEN={fcm_token}")
-            response = messaging.send(message)
-            print("✅ Push sent:", response)
-        except Exception as e:
-            print(e)
+            for index, found in zip(indexes, results):
+                found_windows[index] = found
+                if found and on_found is not None:
+                    on_found(resources[index], found)
+
+        self.fetch_daily(resources, days, equipment, on_batch)
+
+        return [
+            (resource, found)
+            for resource, found in zip(resources, found_windows)
+            if found
+        ]
+
+    def send_push(self, title, body, token=None):
+        """
+        Queue a push alert for one token or a list of tokens (the configured devices if None).
+        Sending happens on the notifier thread, so this never blocks on Firebase.
+        """
+        tokens = token or self.store.push_tokens(self.store.get())
+        self.notifier.notify(tokens, title, body)
 
-    def make_booking_url(self, mapId, start, end, resourceLocationId = None):
+    def make_booking_url(self, mapId, start, end, resourceLocationId = None, equipment = None):
         now = datetime.now()
         c_time = now.strftime("%Y-%m-%dT%H:%M:%S.") + f"{int(now.microsecond / 1000):03d}"
         startDate = self.date2str(start)
         endDate = self.date2str(end)
-        url = f'{self.store.get('url')}/create-booking/results?mapId={mapId}&searchTabGroupId=0&bookingCategoryId=0&startDate={startDate}&endDate={endDate}&nights={end - start}&isReserving=true&equipmentId=-32768&subEquipmentId={self.store.get('equipment')}&peopleCapacityCategoryCounts=%5B%5B-32767,null,1,null%5D%5D&searchTime={c_time}&flexibleSearch=%5Bfalse,false,null,1%5D&filterData=%7B"-32756":"%5B%5B1%5D,0,0,0%5D"%7D'
+        equipment = equipment or self.store.get("equipment")
+        url = f'{self.store.get("url")}/create-booking/results?mapId={mapId}&searchTabGroupId=0&bookingCategoryId=0&startDate={startDate}&endDate={endDate}&nights={end - start}&isReserving=true&equipmentId=-32768&subEquipmentId={equipment}&peopleCapacityCategoryCounts=%5B%5B-32767,null,1,null%5D%5D&searchTime={c_time}&flexibleSearch=%5Bfalse,false,null,1%5D&filterData=%7B"-32756":"%5B%5B1%5D,0,0,0%5D"%7D'
         if resourceLocationId:
             url += f"&resourceLocationId={resourceLocationId}"
         return url
 
-    def search(self, map_id) -> bool:
+    def _expand_(self, map_id, response):
+        """
+        Split a map availability response into available site ids and child map ids.
+        Returns:
+            A tuple of (site_ids, child_map_ids).
+        """
+        site_ids, child_map_ids = [], []
+
+        mapLinkAvailabilities = response.get('mapLinkAvailabilities')
+        resourceAvailabilities = response.get('resourceAvailabilities')
+
+        # remember the topology for the next runs
+        self.topology_seen[str(map_id)] = None if not mapLinkAvailabilities else list(mapLinkAvailabilities.keys())
+
+        if resourceAvailabilities:
+            for site_id, available in resourceAvailabilities.items():
+                if available[0]['availability'] == 7 or available[0]['availability'] == 0:
+                    site_ids.append(site_id)
+        else :
+            prune = self.store.get('prune')
+            for child_map_id, available in mapLinkAvailabilities.items():
+                if prune and available and not any(code in BOOKABLE_MAP_CODES for code in available):
+                    # fully booked for the whole window, skip the subtree
+                    self.crawl_stats['pruned'] += 1
+                    self.crawl_stats['calls_saved'] += self._subtree_size_(child_map_id)
+                    continue
+                child_map_ids.append(child_map_id)
+
+        return site_ids, child_map_ids
+
+    def _check_cancelled_(self):
+        if self.cancel_event.is_set():
+            raise CrawlCancelled()
+
+    def _check_map_(self, map_id, depth, days, equipment=None):
+        """
+        Availability of one crawl node, recorded as a "map" span when tracing.
+        """
+        with self.tracer.span("map", map_id=str(map_id), depth=depth) as span:
+            response = self.api_check(0, days, map_id, None, equipment)
+            if response is None:
+                span['outcome'] = "error"
+            else:
+                span['outcome'] = "ok"
+                span['children'] = len(response.get('mapLinkAvailabilities') or {})
+                span['sites'] = len(response.get('resourceAvailabilities') or {})
+            return response
+
+    def search(self, map_id, days=None, equipment=None, depth=0) -> bool:
+        """
+        Serial DFS crawl of the maps under `map_id` into `site_list`.
+        Returns False if a map of the subtree could not be crawled.
+        """
+
+        self._check_cancelled_()
 
         if map_id == "-2147483403" or map_id == -2147483403: # ignore Jasper Overflow
-            return False
+            return True
 
-        days = self.store.get('days')
+        if days is None:
+            days = self.store.get('days')
 
-        response = self.api_check(0, days , map_id)
+        response = self._check_map_(map_id, depth, days, equipment)
 
         if response is None :
             print(f"Request Error {map_id}")
             return False
         
+        complete = True
         try:
-            mapLinkAvailabilities = response.get('mapLinkAvailabilities')
-            resourceAvailabilities = response.get('resourceAvailabilities')
-
-            if resourceAvailabilities:
-                for site_id, available in resourceAvailabilities.items():
-                    if available[0]['availability'] == 7 or available[0]['availability'] == 0:
-                        self.site_list.append(site_id)
-            else :
-                for child_map_id, available in mapLinkAvailabilities.items():
-                    # if available[0] == 0 or available[0] == 7 or available[0] == 3: # available or partly available
-                        self.search(child_map_id)
+            site_ids, child_map_ids = self._expand_(map_id, response)
+            self.site_list.extend(site_ids)
+            for child_map_id in child_map_ids:
+                complete = self.search(child_map_id, days, equipment, depth + 1) and complete
 
+        except CrawlCancelled:
+            raise
         except Exception as e:
             _debug_print(f"Search-Error {e}")
+            return False
+        return complete
 
-    def run(self):
+    def search_concurrent(self, map_ids, days=None, equipment=None, checkpoint=None) -> list:
         """
-        Run the scraper to find available date ranges.
-        This method will create threads for each range found and wait for them to complete.
+        Crawl the map trees under `map_ids`, expanding sibling maps in parallel.
+        Args:
+            map_ids (list): Root map IDs (parks) to crawl.
+            days (int, optional): Date range in days, defaults to the `days` setting.
+            equipment (str, optional): Sub-equipment category, defaults to the `equipment` setting.
+            checkpoint (CrawlCheckpoint, optional): frontier saved as maps are expanded;
+                a crawl of the same roots interrupted before resumes from it.
+        Returns:
+            list: Available site ids, in the same order as the serial `search`.
         """
+        if days is None:
+            days = self.store.get('days')
+        found = []  # (path, site_ids) so the serial DFS order can be restored
+
+        executor = ThreadPoolExecutor(max_workers=self.concurrency())
+        pending = {}
+
+        def submit(map_id, path):
+            if map_id == "-2147483403" or map_id == -2147483403: # ignore Jasper Overflow
+                return
+            future = executor.submit(self._check_map_, map_id, len(path) - 1, days, equipment)
+            pending[future] = (map_id, path)
+
+        try:
+            if checkpoint is not None and checkpoint.roots == [str(map_id) for map_id in map_ids]:
+                found, frontier = checkpoint.frontier()
+                _debug_print(f"Resuming crawl: {len(found)} maps with sites, {len(frontier)} maps left")
+            else:
+                if checkpoint is not None:
+                    checkpoint.begin(map_ids)
+                frontier = [(map_id, (index,)) for index, map_id in enumerate(map_ids)]
+            for map_id, path in frontier:
+                submit(map_id, path)
+
+            while pending:
+                self._check_cancelled_()
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    map_id, path = pending.pop(future)
+                    response = future.result()
+                    self.root_finished[path[0]] = time.time()
+
+                    if response is None :
+                        # left pending in the checkpoint, a resumed crawl retries it
+                        print(f"Request Error {map_id}")
+                        self.failed_roots.add(path[0])
+                        continue
+
+                    try:
+                        site_ids, child_map_ids = self._expand_(map_id, response)
+                    except Exception as e:
+                        _debug_print(f"Search-Error {e}")
+                        self.failed_roots.add(path[0])
+                        continue
+
+                    children = [(child_map_id, path + (index,)) for index, child_map_id in enumerate(child_map_ids)]
+                    if checkpoint is not None:
+                        checkpoint.expand(path, site_ids, children)
+                    if site_ids:
+                        found.append((path, site_ids))
+                    for child_map_id, child_path in children:
+                        submit(child_map_id, child_path)
+        finally:
+            # drops the queued requests when the crawl is cancelled
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        found.sort(key=lambda item: item[0])
+        return [site_id for _, site_ids in found for site_id in site_ids]
+
+    def _subtree_size_(self, map_id) -> int:
+        """
+        Number of maps under (and including) `map_id` according to the topology cache.
+        """
+        size, stack = 0, [str(map_id)]
+        while stack:
+            node = stack.pop()
+            size += 1
+            children = self.topology.get(node, (None, None))[0]
+            if children:
+                stack.extend(children)
+        return size
+
+    def _crawl_roots_(self, parks) -> list:
+        """
+        Crawl roots of `parks`. With the `topology_cache` setting and pruning off, each park
+        is replaced with its cached leaf maps, skipping the calls to the maps above them.
+        With `prune`, the crawl starts at the parks so fully booked subtrees are skipped from
+        the codes of their parent maps; the cache then only sizes the pruned subtrees.
+        """
+        # park -> indexes of its roots, for per-park crawl times
+        self.root_parks = {}
+        if not self.store.get('topology_cache') or self.store.get('prune'):
+            self.root_parks = {park_id: [index] for index, park_id in enumerate(parks)}
+            return list(parks)
+
+        roots = []
+        for park_id in parks:
+            leaves, _ = self.store.map_leaves(park_id, self.topology)
+            if leaves is None:
+                # crawled from the park, the crawl records its tree
+                self.root_parks[park_id] = [len(roots)]
+                roots.append(park_id)
+                continue
+            self.root_parks[park_id] = list(range(len(roots), len(roots) + len(leaves)))
+            roots.extend(leaves)
+        return roots
+
+    def _revalidate_stale_(self, parks):
+        """
+        After a crawl that used the topology cache, refresh in the background the trees of
+        `parks` that are still missing or stale once the crawl's own maps are saved.
+        """
+        if not self.store.get('topology_cache') or self.store.get('prune'):
+            return
+
+        ttl = (self.store.get('topology_ttl') or 24) * 3600
+        tree = self.store.load_map_tree()
+        revalidate = []
+        for park_id in parks:
+            leaves, updated_at = self.store.map_leaves(park_id, tree)
+            if leaves is None or time.time() - updated_at > ttl:
+                revalidate.append(park_id)
+
+        if revalidate:
+            threading.Thread(target=self.revalidate_topology, args=(revalidate,), daemon=True).start()
+
+    def revalidate_topology(self, parks):
+        """
+        Rediscover the map hierarchy of `parks` (no pruning) and refresh the topology cache.
+        Maps refreshed within `topology_ttl` are taken from the cache instead of requested again.
+        Uses its own HTTP session so it can outlive the crawl that started it.
+        """
+        with self.result_lock:
+            parks = [park_id for park_id in parks if park_id not in self.revalidating]
+            self.revalidating.update(parks)
+
+        import requests
+
+        ttl = (self.store.get('topology_ttl') or 24) * 3600
+        tree = self.store.load_map_tree()
+        session = requests.Session()
+        try:
+            for park_id in parks:
+                nodes, stack = {}, [park_id]
+                while stack:
+                    map_id = stack.pop()
+                    if map_id == "-2147483403" or map_id == -2147483403: # ignore Jasper Overflow
+                        continue
+                    children, updated_at = tree.get(str(map_id), (None, None))
+                    if updated_at is not None and time.time() - updated_at <= ttl:
+                        stack.extend(children or [])
+                        continue
+                    response = self.api_check(0, 1, map_id, session=session)
+                    if response is None:
+                        print(f"Topology Request Error {map_id}")
+                        break
+                    mapLinkAvailabilities = response.get('mapLinkAvailabilities')
+                    nodes[str(map_id)] = None if not mapLinkAvailabilities else list(mapLinkAvailabilities.keys())
+                    stack.extend(mapLinkAvailabilities or [])
+                else:
+                    self.store.save_map_tree(nodes)
+                    _debug_print(f"Topology of park #{park_id} refreshed ({len(nodes)} maps)")
+        finally:
+            session.close()
+            with self.result_lock:
+                self.revalidating.difference_update(parks)
+
+    def _begin_crawl_(self):
+        self.site_list = []
+        # parks whose sites are incomplete this run, they keep their previous results
+        self.failed_parks = []
+        # indexes of the crawl roots with a map that could not be crawled
+        self.failed_roots = set()
+        self.crawl_stats = {"pruned" : 0, "calls_saved" : 0}
+        self.root_finished = {}
+        self.topology = self.store.load_map_tree()
+        self.topology_seen = {}
+
+    def _search_roots_(self, roots, days=None, equipment=None, checkpoint=None):
+        """
+        Crawl the map trees under `roots` into `site_list`, serially or concurrently
+        depending on the `concurrency` setting (checkpointed crawls always go through
+        the frontier of `search_concurrent`). `root_finished` gets the time each
+        root's tree was done, `failed_roots` the roots with a map that failed.
+        """
+        if self.concurrency() > 1 or checkpoint is not None:
+            self.site_list = self.search_concurrent(roots, days, equipment, checkpoint)
+        else :
+            for index, map_id in enumerate(roots):
+                if not self.search(map_id, days, equipment):
+                    self.failed_roots.add(index)
+                self.root_finished[index] = time.time()
+
+    def crawl(self, parks, days=None, equipment=None, checkpoint=None) -> list:
+        """
+        Collect the available site ids of every park, serially or concurrently
+        depending on the `concurrency` setting. With a `checkpoint`, the crawl
+        resumes from its saved frontier, or is skipped if it had finished.
+        Parks with a map that could not be crawled are listed in `failed_parks`.
+        """
+        self._begin_crawl_()
+        if checkpoint is not None and checkpoint.sites is not None:
+            _debug_print(f"Resuming after the crawl: {len(checkpoint.sites)} sites")
+            self.site_list = checkpoint.sites
+            self.failed_parks = checkpoint.failed
+            return self.site_list
+
+        roots = self._crawl_roots_(parks)
+        started = time.time()
+        self._search_roots_(roots, days, equipment, checkpoint)
+
+        # a park is done when the last map under any of its roots is
+        for park_id in parks:
+            finished = [self.root_finished[index] for index in self.root_parks.get(park_id, []) if index in self.root_finished]
+            if finished:
+                metrics.CRAWL_SECONDS.observe(max(finished) - started, park=park_id)
+
+        self.failed_parks = [
+            park_id for park_id in parks
+            if any(index in self.failed_roots for index in self.root_parks.get(park_id, []))
+        ]
+        for park_id in self.failed_parks:
+            print(f"Maps of park #{park_id} could not be crawled, the park keeps its previous results")
+
+        self.store.save_map_tree(self.topology_seen)
+        self._revalidate_stale_(parks)
+        if checkpoint is not None:
+            checkpoint.crawled(self.site_list, self.failed_parks)
+        return self.site_list
+
+    def crawl_item(self, payload) -> dict:
+        """
+        Work item of a sharded run, in a worker process: crawl the item's root maps,
+        then fetch the daily availability of the sites found. With the `checkpoint`
+        setting, an item handed out again after its worker died resumes its progress.
+        Args:
+            payload: {"park_id", "roots", "days", "equipment", "today"}, see crawl_sharded.
+        Returns:
+            dict: the site ids in crawl order, the daily availability responses by
+            resource id, the crawl time (0 if resumed after the crawl), whether a map
+            could not be crawled, API calls and pruning stats.
+        """
+        # dates are offsets from the coordinator's day
+        self.today = date.fromisoformat(payload['today'])
+        api_calls = self.api_calls
+
+        checkpoint = None
+        if self.store.get('checkpoint'):
+            max_age = (self.store.get('checkpoint_max_age') or 60) * 60
+            checkpoint = CrawlCheckpoint(self.store, checkpoint_key('item', payload), payload['today'], time.time(), max_age, max_age)
+
+        self._begin_crawl_()
+        started = time.time()
+        if checkpoint is not None and checkpoint.sites is not None:
+            # crawled before the restart, its time was not kept
+            self.site_list = checkpoint.sites
+            self.failed_parks = checkpoint.failed
+        else:
+            self._search_roots_(payload['roots'], payload['days'], payload['equipment'], checkpoint)
+            if self.failed_roots:
+                self.failed_parks = [payload['park_id']]
+            self.store.save_map_tree(self.topology_seen)
+            if checkpoint is not None:
+                checkpoint.crawled(self.site_list, self.failed_parks)
+        finished = max(self.root_finished.values(), default=started)
+
+        resources = self._resources_(self.site_list)
+        responses = self.fetch_daily(resources, payload['days'], payload['equipment'], checkpoint=checkpoint)
+        if checkpoint is not None:
+            # the result is stored with the item from here on
+            checkpoint.clear()
+        return {
+            "sites" : self.site_list,
+            "responses" : {
+                str(resource['id']) : response
+                for resource, response in zip(resources, responses) if response is not None
+            },
+            "seconds" : finished - started,
+            "failed" : bool(self.failed_parks),
+            "api_calls" : self.api_calls - api_calls,
+            **self.crawl_stats,
+        }
+
+    def _start_workers_(self, batch, count):
+        """
+        Start `count` worker processes (worker.py) working the items of `batch`.
+        """
+        workers = []
+        for _ in range(count):
+            try:
+                workers.append(subprocess.Popen([sys.executable, os.path.join(ROOT, 'worker.py'), '--batch', batch]))
+            except OSError as e:
+                print(f"Could not start a crawl worker: {e}")
+        return workers
+
+    def crawl_sharded(self, parks, days=None, equipment=None, checkpoint=None):
+        """
+        Crawl `parks` and fetch their daily availability in `shards` worker processes.
+        Each park becomes one or more work items of at most `shard_maps` root maps on
+        the durable work queue; results are merged in park order, like a local crawl.
+        When no local worker is left while items remain (they failed to start or
+        crashed), this process works the rest itself. Parks with a failed item are
+        left out of the results and listed in `failed_parks`. With a `checkpoint`, a
+        restarted run picks up the batch queued before, or the merged results.
+        Returns:
+            A tuple of (resources, responses) like the local crawl and fetch_daily.
+        """
+        from workqueue import WorkQueue, PENDING, CLAIMED, FAILED
+        from worker import process, worker_name
+
+        if days is None:
+            days = self.store.get('days')
+        queue = WorkQueue(self.store, lease=self.store.get('shard_lease') or 300)
+
+        self._begin_crawl_()
+        if checkpoint is not None and checkpoint.sites is not None:
+            _debug_print(f"Resuming after the crawl: {len(checkpoint.sites)} sites")
+            self.site_list = checkpoint.sites
+            self.failed_parks = checkpoint.failed
+            saved = checkpoint.responses()
+            resources = self._resources_(self.site_list)
+            return resources, [saved.get(int(resource['id'])) for resource in resources]
+
+        batch = checkpoint.batch if checkpoint is not None else None
+        progress = queue.progress(batch) if batch else None
+        if progress and any(progress.values()):
+            # queued before the restart, workers may still be on it
+            items, remaining = sum(progress.values()), progress[PENDING] + progress[CLAIMED]
+            _debug_print(f"Resuming work queue batch {batch}: {remaining} of {items} items left")
+        else:
+            roots = self._crawl_roots_(parks)
+            chunk = max(int(self.store.get('shard_maps') or 16), 1)
+            payloads = []
+            for park_id in parks:
+                park_roots = [roots[index] for index in self.root_parks.get(park_id, [])]
+                for offset in range(0, len(park_roots), chunk):
+                    payloads.append({
+                        "park_id" : park_id,
+                        "roots" : park_roots[offset:offset + chunk],
+                        "days" : days,
+                        "equipment" : equipment,
+                        "today" : self.today.isoformat(),
+                    })
+
+            batch = uuid.uuid4().hex
+            queue.put(batch, payloads)
+            if checkpoint is not None:
+                checkpoint.set_batch(batch)
+            items = remaining = len(payloads)
+
+        workers = self._start_workers_(batch, min(self.shards(), remaining))
+        _debug_print(f"Queued {remaining} work items of {len(parks)} parks for {len(workers)} workers")
+
+        owner = worker_name()
+        api_calls = self.api_calls
+        try:
+            while True:
+                self._check_cancelled_()
+                progress = queue.progress(batch)
+                if not progress[PENDING] and not progress[CLAIMED]:
+                    break
+                if all(worker.poll() is not None for worker in workers):
+                    # no local worker left, finish the batch here
+                    item = queue.claim(owner, batch)
+                    if item is not None:
+                        process(self, queue, item, owner)
+                        continue
+                time.sleep(0.2)
+        except BaseException:
+            # cancelled or failed, the workers stop with this run
+            for worker in workers:
+                worker.terminate()
+                worker.wait()
+            if checkpoint is not None:
+                # handed out again by the next run
+                queue.release(batch)
+            else:
+                queue.cancel(batch)
+            raise
+        finally:
+            for worker in workers:
+                if worker.poll() is None:
+                    worker.terminate()
+                worker.wait()
+
+        self._begin_crawl_()
+        # items worked here are counted with the others below
+        self.api_calls = api_calls
+        by_resource, park_seconds = {}, {}
+        results = queue.results(batch)
+        failed = {payload['park_id'] for payload, result in results if result is None or result.get('failed')}
+        self.failed_parks = [park_id for park_id in parks if park_id in failed]
+        for park_id in self.failed_parks:
+            print(f"A work item of park #{park_id} failed or is incomplete, the park keeps its previous results")
+        for payload, result in results:
+            if result is None or payload['park_id'] in failed:
+                continue
+            self.site_list.extend(result['sites'])
+            by_resource.update(result['responses'])
+            self.crawl_stats['pruned'] += result['pruned']
+            self.crawl_stats['calls_saved'] += result['calls_saved']
+            self.api_calls += result['api_calls']
+            park_seconds[payload['park_id']] = max(park_seconds.get(payload['park_id'], 0), result['seconds'])
+        if progress[FAILED]:
+            print(f"{progress[FAILED]} of {items} work items failed")
+        if checkpoint is not None:
+            checkpoint.crawled(self.site_list, self.failed_parks)
+            checkpoint.save_responses({int(resource_id) : response for resource_id, response in by_resource.items()})
+        queue.purge(batch)
+        # the workers saved the maps they crawled
+        self._revalidate_stale_(parks)
+
+        for park_id, seconds in park_seconds.items():
+            # 0 when every item of the park was crawled before a restart
+            if seconds:
+                metrics.CRAWL_SECONDS.observe(seconds, park=park_id)
+
+        resources = self._resources_(self.site_list)
+        return resources, [by_resource.get(str(resource['id'])) for resource in resources]
+
+    def _resources_(self, site_ids) -> list:
+        """
+        resource_map rows of `site_ids`, skipping unknown sites.
+        """
+        resources = []
+        for resource_id in site_ids:
+            resource = self.store.lookup('resource_map', resource_id)
+
+            if resource is None:
+                _debug_print(f"Resource #{resource_id} not exist in the database..")
+                continue
+            resources.append(resource)
+        return resources
+
+    def _result_entry_(self, resource, found_windows, equipment=None):
+        """
+        Build the searchResult entry of a resource and its (start_index, end_index) windows.
+        """
+        location = self.store.find_location(resource['location_id'])
+        stays = [{
+            "start_date" : self.date2str(start),
+            "end_date" : self.date2str(end),
+            "nights" : end - start,
+            "booking_url" : self.make_booking_url(resource['map_id'], start, end, resource['location_id'], equipment)
+        } for start, end in found_windows]
+
+        return {
+            "id"   : resource['id'],
+            "park_id" : resource['park_id'],
+            "site" : resource['name'],
+            "img_url" : json.loads(resource['photos']),
+            "full_name" : location['full_name'],
+            "attributes" : json.loads(resource['attr'].decode('utf-8')),
+            "category" : resource['category'],
+            "description" : resource['description'],
+            "start_date" : stays[0]['start_date'],
+            "end_date" : stays[0]['end_date'],
+            "capacity" : resource['capacity'],
+            "booking_url" : stays[0]['booking_url'],
+            "windows" : stays,
+            "added_to_cart" : False
+        }
+
+    def crawl_plan(self, profiles, parks=None):
+        """
+        Group the profiles sharing the same crawl parameters, so each park is
+        crawled once per (equipment, days) instead of once per profile.
+        Args:
+            profiles: watch profiles, see Store.profiles.
+            parks: park ids to crawl, every park of the profiles if None.
+        Returns:
+            list: [{"equipment", "days", "parks", "profiles"}] in profile order.
+        """
+        groups = {}
+        for profile in profiles:
+            profile_parks = [
+                park_id for park_id in profile.get('location') or []
+                if parks is None or park_id in parks
+            ]
+            if not profile_parks:
+                continue
+            key = (profile.get('equipment'), profile.get('days'))
+            group = groups.setdefault(key, {
+                "equipment" : key[0],
+                "days" : key[1],
+                "parks" : [],
+                "profiles" : [],
+            })
+            group['parks'].extend(park_id for park_id in profile_parks if park_id not in group['parks'])
+            group['profiles'].append(profile)
+        return list(groups.values())
+
+    def run(self, parks=None):
+        """
+        Run the scraper to find available date ranges for every watch profile.
+        Profiles with the same equipment and date range share one crawl and one
+        daily availability request per site; windows are then found per profile.
+        When the `trace` setting names a directory, the run's spans are written
+        there as a Chrome trace (run-<time>.json), also for failed runs.
+        Each park's results are published as soon as its daily availability is
+        complete; each profile's searchDelta and push alert cover the whole run. With the `checkpoint` setting, progress is saved as the run goes
+        and a run of the same parks restarted after a crash or cancel resumes it.
+        Args:
+            parks: park ids to crawl, all watched parks if None. Results of the
+                other parks are kept from the previous run.
+        Returns:
+            dict: run statistics (API calls, sites crawled, available and new sites).
+        Raises:
+            CrawlCancelled: if the scheduler cancelled the run; parks not published
+                yet keep their previous results.
+        """
+        trace_dir = self.store.get('trace')
+        self.tracer = Tracer() if trace_dir else NULL_TRACER
+        started = datetime.now()
+        try:
+            with self.tracer.span("run", "run", parks=parks):
+                return self._run_(parks)
+        finally:
+            if trace_dir:
+                path = os.path.join(trace_dir, f"run-{started.strftime('%Y%m%d-%H%M%S')}.json")
+                self.tracer.export(path)
+                _debug_print(f"Trace written to {path}")
+
+    def _run_(self, parks):
 
         # time log
         _start_time = time.time()
@@ -481,85 +1280,351 @@ class Scraper:
             "\n------------------------------\n",
         )
 
-        days = self.store.get('days')
-        parks = self.store.get('location')
+        # pick up rows written by other processes since the last run
+        self.store.load_index()
+
+        profiles = self.store.profiles()
+        started = datetime.now()
+        run_time = started.strftime("%Y-%m-%d %H:%M:%S")
+        available = {}
+        sites, new = 0, 0
+        recorded = set()
+        checkpoints = []
+
+        for group in self.crawl_plan(profiles, parks):
+            group_time = run_time
+            checkpoint = self._checkpoint_(group, parks, started.timestamp())
+            if checkpoint is not None:
+                checkpoints.append(checkpoint)
+                if checkpoint.stage == CHECKPOINT_DONE:
+                    _debug_print(f"Parks {group['parks']} were published by the interrupted run, skipping")
+                    continue
+                # resumed results are as old as the run that started fetching them
+                group_time = datetime.fromtimestamp(checkpoint.started_at).strftime("%Y-%m-%d %H:%M:%S")
+
+            sharded = self.shards() > 0
+            with self.tracer.span("crawl", "run", parks=group['parks'], equipment=group['equipment'], shards=self.shards()):
+                if sharded:
+                    resources, responses = self.crawl_sharded(group['parks'], group['days'], group['equipment'], checkpoint)
+                else:
+                    self.crawl(group['parks'], group['days'], group['equipment'], checkpoint)
+            sites += len(self.site_list)
+
+            _debug_print(f"Found {len(self.site_list)} sites available...", self.site_list)
+            _debug_print(
+                f"Pruned {self.crawl_stats['pruned']} fully booked maps, "
+                f"saved {self.crawl_stats['calls_saved']} API calls"
+            )
 
-        self.site_list = []
-        search_results = {
-            "time" : datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "data" : []
+            if not sharded:
+                resources = self._resources_(self.site_list)
+
+            # sites left to fetch per park; a park is published as soon as it has none
+            remaining = {park_id : 0 for park_id in group['parks']}
+            for resource in resources:
+                remaining[resource['park_id']] = remaining.get(resource['park_id'], 0) + 1
+            for park_id in group['parks']:
+                metrics.CRAWL_SITES.set(remaining[park_id], park=park_id)
+
+            published = []
+            # windows found so far, per profile: resource index -> windows
+            found = {profile['id'] : {} for profile in group['profiles']}
+            # results before this run, the searchDelta and push cover the whole group
+            previous_results = {
+                profile['id'] : self.store.load(self.store.result_file("searchResult", profile['id']))
+                for profile in group['profiles']
+            }
+            previous_keys = {profile_id : window_keys(results) for profile_id, results in previous_results.items()}
+            changed = {}
+
+            def publish_finished(batch=()):
+                for profile in group['profiles']:
+                    found[profile['id']].update(
+                        self._find_profile_windows_(profile, resources, batch, previous_keys[profile['id']])
+                    )
+                for index, response in batch:
+                    park_id = resources[index]['park_id']
+                    remaining[park_id] -= 1
+                    if response is None and park_id not in self.failed_parks:
+                        print(f"Daily availability of park #{park_id} is incomplete, the park keeps its previous results")
+                        self.failed_parks.append(park_id)
+                finished = [
+                    park_id for park_id in group['parks']
+                    if not remaining[park_id] and park_id not in published and park_id not in self.failed_parks
+                ]
+                if finished:
+                    published.extend(finished)
+                    for profile in self._publish_parks_(group, published, resources, found, group_time, available):
+                        changed[profile['id']] = profile
+
+            try:
+                if sharded:
+                    for offset in range(0, len(responses), WINDOW_BATCH_SIZE):
+                        publish_finished([
+                            (index, responses[index])
+                            for index in range(offset, min(offset + WINDOW_BATCH_SIZE, len(responses)))
+                        ])
+                else:
+                    with self.tracer.span("fetch_daily", "run", resources=len(resources)):
+                        responses = self.fetch_daily(resources, group['days'], group['equipment'], publish_finished, checkpoint)
+                # parks without any available site
+                publish_finished()
+            finally:
+                # also for a cancelled run, for the parks it published
+                for profile in changed.values():
+                    new += self._publish_delta_(profile, previous_results[profile['id']])
+
+            if self.store.get('history'):
+                # one snapshot per park and run, from the first group crawling it
+                parks_to_record = [
+                    park_id for park_id in group['parks'] if park_id not in recorded and park_id not in self.failed_parks
+                ]
+                with self.tracer.span("history", "run", parks=parks_to_record):
+                    self.record_history(parks_to_record, resources, responses, group['days'])
+                recorded.update(parks_to_record)
+
+            if checkpoint is not None:
+                checkpoint.done()
+
+        _debug_print(f"Response cache : {self.cache.stats}")
+        _debug_print(
+            f"Running Time: {time.time() - _start_time:.2f} seconds, API Calls : {self.api_calls}"
+        )
+
+        self._del_session_()
+
+        # the run is complete, the next one starts from scratch
+        for checkpoint in checkpoints:
+            checkpoint.clear()
+
+        return {
+            "api_calls" : self.api_calls,
+            "sites" : sites,
+            "available" : sum(available.values()),
+            "new" : new,
         }
-        push_results = 0
 
+    def _checkpoint_(self, group, parks, started):
+        """
+        Checkpoint of a crawl group of the run of `parks` started at `started`, when
+        the `checkpoint` setting is on. Only a run interrupted less than one job
+        interval ago is resumed, never the one the next scheduled run replaces.
+        """
+        if not self.store.get('checkpoint'):
+            return None
+        key = checkpoint_key(parks, group['parks'], group['equipment'], group['days'])
+        keep = (self.store.get('checkpoint_max_age') or 60) * 60
+        interval = next(
+            (job.interval for job in self.scheduler.jobs if job.parks == parks),
+            self.store.get('interval') or 30
+        )
+        # scheduled runs start at least an interval minus the jitter apart
+        max_age = min(keep, interval * 60 - (self.store.get('jitter') or 0))
+        return CrawlCheckpoint(self.store, key, self.today.isoformat(), started, max_age, keep)
+
+    def _publish_parks_(self, group, done, resources, found, run_time, available):
+        """
+        Publish the searchResult of the profiles of a crawl group for the parks in
+        `done`, whose daily availability is complete; the other parks keep their
+        previous results. The searchDelta is written once per group, see _publish_delta_.
+        Args:
+            found: profile id -> {resource index: windows}, see _find_profile_windows_.
+            available: profile id -> number of available sites, updated.
+        Returns:
+            list: the profiles published.
+        """
+        published = []
+        for profile in group['profiles']:
+            profile_parks = [park_id for park_id in profile.get('location') or [] if park_id in done]
+            if not profile_parks:
+                continue
+            with self.tracer.span("windows", "run", profile=profile['id'], parks=profile_parks):
+                search_results = self._profile_results_(profile, resources, found[profile['id']], run_time, profile_parks)
+            available[profile['id']] = len(search_results['data'])
+            with self.tracer.span("publish", "run", profile=profile['id'], parks=profile_parks):
+                self._publish_profile_(profile, search_results, done)
+            published.append(profile)
+        return published
+
+    def record_history(self, parks, resources, responses, days):
+        """
+        Add this run's daily availability of `parks` to the availability history,
+        then drop snapshots older than `history_days`.
+        """
+        by_resource = {
+            int(resource['id']) : response
+            for resource, response in zip(resources, responses) if response is not None
+        }
+        # crawled as available but the daily fetch failed, their state is unknown
+        failed = [int(resource['id']) for resource, response in zip(resources, responses) if response is None]
         for park_id in parks:
-            self.search(park_id)
+            cursor = self.store.execute('SELECT id FROM resource_map WHERE park_id = ?', (park_id,))
+            resource_ids = [row['id'] for row in cursor] if cursor is not None else []
+            self.history.record(park_id, resource_ids, by_resource, self.today, days, unknown=failed)
 
-        _debug_print(f"Found {len(self.site_list)} sites available...", self.site_list)
+        max_age = self.store.get('history_days')
+        if max_age:
+            self.history.prune(max_age)
 
-        for resource_id in self.site_list:
-            resource = self.store.fetch_one('resource_map', 'id = ?', (resource_id,))
+    def _find_profile_windows_(self, profile, resources, batch, previous_keys):
+        """
+        Find one profile's windows in a batch of daily availability responses of a
+        shared crawl, publishing a "site" event for every window it did not have yet.
+        Args:
+            batch: [(resource index, response), ...] as passed to fetch_daily's on_batch.
+            previous_keys: window keys of the profile's previous searchResult.
+        Returns:
+            dict: resource index -> windows, for the sites of the profile's parks with any.
+        """
+        profile_parks = profile.get('location') or []
+        selected = [(index, response) for index, response in batch if resources[index]['park_id'] in profile_parks]
+        if not selected:
+            return {}
+
+        results = self.find_windows(
+            [response for _, response in selected],
+            [resources[index].get('max_stay') for index, _ in selected],
+            profile.get('nights')
+        )
 
-            if resource is None:
-                _debug_print(f"Resource #{resource_id} not exist in the database..")
+        found = {}
+        for (index, _), found_windows in zip(selected, results):
+            if not found_windows:
+                continue
+            found[index] = found_windows
+            resource = resources[index]
+            new_windows = [
+                (start, end) for start, end in found_windows
+                if (resource['id'], self.date2str(start), self.date2str(end)) not in previous_keys
+            ]
+            if new_windows:
+                entry = self._result_entry_(resource, new_windows, profile.get('equipment'))
+                entry['profile'] = profile['id']
+                self.events.publish("site", entry)
+        return found
+
+    def _profile_results_(self, profile, resources, found, run_time, parks=None):
+        """
+        Build the searchResult of one profile from the windows found in a shared crawl.
+        Only the sites of `parks` are included, if given.
+        Args:
+            found: resource index -> windows, see _find_profile_windows_.
+        """
+        profile_parks = parks if parks is not None else profile.get('location') or []
+        return {
+            "time" : run_time,
+            "data" : [
+                self._result_entry_(resources[index], found[index], profile.get('equipment'))
+                for index in sorted(found) if resources[index]['park_id'] in profile_parks
+            ]
+        }
 
-            found_range = self.find_availability(0, days, resource['id'])
-            if found_range:
-                push_results += 1
-                booking_url = self.make_booking_url(resource['map_id'], found_range[0], found_range[1], resource['location_id'])
-                location = self.store.find_location(resource['location_id'])
-                
-                search_results["data"].append({
-                    "id"   : resource['id'],
-                    "site" : resource['name'],
-                    "img_url" : json.loads(resource['photos']),
-                    "full_name" : location['full_name'],
-                    "attributes" : json.loads(resource['attr'].decode('utf-8')),
-                    "category" : resource['category'],
-                    "description" : resource['description'],
-                    "start_date" : self.date2str(found_range[0]),
-                    "end_date" : self.date2str(found_range[1]),
-                    "capacity" : resource['capacity'],
-                    "booking_url" : booking_url,
-                    "added_to_cart" : False
-                })
+    def _publish_profile_(self, profile, search_results, parks=None):
+        """
+        Write a profile's new searchResult, keeping the cart flags of its previous
+        one and, if `parks` is given, the previous hits of its other parks.
+        """
+        result_file = self.store.result_file("searchResult", profile['id'])
+        previous_results = self.store.load(result_file)
+        profile_parks = profile.get('location') or []
+
+        # keep the previous hits of watched parks this run did not crawl
+        if parks is not None:
+            search_results["data"].extend(
+                entry for entry in previous_results.get('data', [])
+                if entry.get('park_id') is not None
+                and entry['park_id'] in profile_parks and entry['park_id'] not in parks
+            )
 
+        carry_over_cart_flags(previous_results, search_results)
+        self.store.flush(result_file, search_results)
+
+    def _publish_delta_(self, profile, previous_results):
+        """
+        Diff a profile's current searchResult against `previous_results`, its
+        results before this run, write the searchDelta and push the profile's
+        devices when sites were added.
+        Returns:
+            int: number of sites with new windows.
+        """
+        search_results = self.store.load(self.store.result_file("searchResult", profile['id']))
+        delta = diff_results(previous_results, search_results)
         _debug_print(
-            f"Running Time: {time.time() - _start_time:.2f} seconds, API Calls : {self.api_calls}"
+            f"Changes [{profile['id']}] : {len(delta['added'])} sites with new windows, "
+            f"{len(delta['removed'])} windows gone, {delta['unchanged']} unchanged"
         )
 
-        self._del_session_()
+        self.store.flush(self.store.result_file("searchDelta", profile['id']), delta)
+        self.events.publish("delta", {
+            "profile" : profile['id'],
+            "time" : delta['time'],
+            "added" : len(delta['added']),
+            "removed" : delta['removed'],
+            "unchanged" : delta['unchanged'],
+        })
 
-        self.store.flush("searchResult", search_results)
-        
-        self.send_push(
-            f"PARKS CANADA ALERT ({search_results['time']})",
-            f"""
-                Available Sites Found : {push_results}
-            """,
-        )
+        if delta['added']:
+            self.send_push(
+                f"PARKS CANADA ALERT ({search_results['time']})",
+                f"""
+                    New Sites Found : {len(delta['added'])} (of {len(search_results['data'])} available)
+                """,
+                self.store.push_tokens(profile),
+            )
+
+        return len(delta['added'])
+
+    def _make_jobs_(self):
+        """
+        Scheduler jobs from the settings: one per entry of `schedules`
+        ({"name", "parks", "interval"}), plus a default job for the remaining parks.
+        """
+        location = self.store.all_parks()
+        interval = self.store.get('interval') or 30
+
+        jobs, scheduled = [], set()
+        for schedule in self.store.get('schedules') or []:
+            parks = [park_id for park_id in schedule.get('parks', []) if park_id in location]
+            if not parks:
+                continue
+            jobs.append(Job(schedule.get('name') or ','.join(parks), schedule.get('interval') or interval, parks))
+            scheduled.update(parks)
+
+        remaining = [park_id for park_id in location if park_id not in scheduled]
+        if remaining:
+            jobs.insert(0, Job("default", interval, remaining if scheduled else None))
+        return jobs
 
     def start(self):
+        """
+        Start the background scheduler. Returns immediately; the first run starts right away.
+        """
         with self.lock:
-            if self.process is not None:
-                self.process.cancel()
             self.is_running = True
-            self.run()
-            self.process = threading.Timer(self.store.get('interval') * 60, self.start)
-            self.process.start()
+            self.scheduler.start()
 
     def stop(self):
+        """
+        Stop scheduling and cancel the run in progress without waiting for it.
+        """
         with self.lock:
             self.is_running = False
-            if self.process is not None:
-                self.process.cancel()
-                self.process = None
+            self.scheduler.stop()
 
-    def set_fcm_token(self, token):
+    def set_fcm_token(self, token, profile_id=None):
         print(f"Token received :{token}")
-        if token and token != self.store.get('token'):
-            self.store.update({
-                "token" : token
-            })
+        if token:
+            self.store.add_token(token, profile_id)
+
+    def save_profile(self, profile):
+        self.store.save_profile(profile)
+        self.scheduler.set_jobs(self._make_jobs_())
+
+    def delete_profile(self, profile_id) -> bool:
+        deleted = self.store.delete_profile(profile_id)
+        if deleted:
+            self.scheduler.set_jobs(self._make_jobs_())
+        return deleted
 
     def update_setting(self, location, equipement, days, interval, blocks):
         self.store.update({
@@ -569,21 +1634,24 @@ class Scraper:
             "days" :   days,
             "nights" : blocks
         })
+        self.scheduler.set_jobs(self._make_jobs_())
 
     def put_cart(self, new_cart):
         try:
             all_carts = self.store.load("cart")
-            results = self.store.load("searchResult")
 
             new_carts = [cart for cart in all_carts if cart["id"] != new_cart["id"]]
             new_carts.append(new_cart)
 
-            for i in range(len(results['data'])):
-                if results['data'][i]['id'] == new_cart['id']:
-                    results['data'][i]['added_to_cart'] = True
-                    break
+            for profile in self.store.profiles():
+                result_file = self.store.result_file("searchResult", profile['id'])
+                results = self.store.load(result_file)
+                for i in range(len(results.get('data', []))):
+                    if results['data'][i]['id'] == new_cart['id']:
+                        results['data'][i]['added_to_cart'] = True
+                        self.store.flush(result_file, results)
+                        break
 
-            self.store.flush("searchResult", results)
             self.store.flush("cart", new_carts)
         except Exception as e:
             _debug_print(f"Put Cart Error - {e}")
@@ -591,18 +1659,21 @@ class Scraper:
     def delete_cart(self, cart_id):
         try:
             all_carts = self.store.load('cart')
-            search_results = self.store.load('searchResult')
             
             if cart_id == 'all':
                 new_carts = []
             else :
                 new_carts = [cart for cart in all_carts if cart["id"] != cart_id]
 
-            for i in range(len(search_results['data'])):
-                if search_results['data'][i]['id'] == cart_id:
-                    search_results['data'][i].update({'added_to_cart' : False})
+            for profile in self.store.profiles():
+                result_file = self.store.result_file('searchResult', profile['id'])
+                search_results = self.store.load(result_file)
+                for i in range(len(search_results.get('data', []))):
+                    if search_results['data'][i]['id'] == cart_id:
+                        search_results['data'][i].update({'added_to_cart' : False})
+                if search_results:
+                    self.store.flush(result_file, search_results)
             
-            self.store.flush('searchResult', search_results)
             self.store.flush('cart', new_carts)
         except Exception as e:
             _debug_print(f"Delete Cart Error - {e}")
@@ -612,5 +1683,6 @@ if __name__ == "__main__":
     scraper = Scraper()
 
     scraper.run()
+    scraper.notifier.flush(timeout=30)
 
     input('Press Enter...')
\ No newline at end of file
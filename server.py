@@ -1,21 +1,98 @@
-from flask import Flask, request, jsonify, render_template
+from datetime import datetime
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
 from flask_cors import CORS
 from threading import Thread
 from scraper import Scraper
+from metrics import REGISTRY
+
+# Seconds between SSE keepalive comments / longest long-poll wait
+STREAM_KEEPALIVE = 15
+STREAM_POLL_TIMEOUT = 25
+STREAM_RETRY_MS = 3000
 
 app = Flask(__name__)
 CORS(app)
 scraper = Scraper()
 
+def snapshot_response(name):
+    """
+    Serve a store snapshot as-is: gzip when accepted, 304 when the client's ETag is current.
+    """
+    snapshot = scraper.store.snapshot(name)
+    if snapshot is None:
+        return jsonify({})
+
+    gzipped = request.accept_encodings['gzip'] > 0
+    response = Response(snapshot.gzip_body if gzipped else snapshot.body, mimetype="application/json")
+    if gzipped:
+        response.headers["Content-Encoding"] = "gzip"
+    response.set_etag(f"{snapshot.etag}-gz" if gzipped else snapshot.etag)
+    response.headers["X-Snapshot-Version"] = str(snapshot.version)
+    response.headers["Cache-Control"] = "no-cache"
+    response.vary.add("Accept-Encoding")
+    return response.make_conditional(request)
+
+def profile_file(kind):
+    """Results file of the `?profile=` watch profile (the first profile by default), None if unknown."""
+    profile = scraper.store.profile(request.args.get("profile"))
+    if profile is None:
+        return None
+    return scraper.store.result_file(kind, profile['id'])
+
 @app.route("/api/messages", methods=["GET"])
 def get_messages():
-    return jsonify(
-        scraper.store.load('searchResult')
-    )
+    name = profile_file('searchResult')
+    if name is None:
+        return jsonify({"code": "404", "msg": "Unknown profile"}), 404
+    return snapshot_response(name)
+
+@app.route("/api/messages/delta", methods=["GET"])
+def get_messages_delta():
+    name = profile_file('searchDelta')
+    if name is None:
+        return jsonify({"code": "404", "msg": "Unknown profile"}), 404
+    return snapshot_response(name)
+
+@app.route("/api/stream", methods=["GET"])
+def stream():
+    """
+    New or changed sites as they are found.
+    Server-sent events by default; `?mode=poll` long-polls and returns the events as JSON.
+    Resume with the Last-Event-ID header or `?since=<event id>`.
+    """
+    events = scraper.events
+    since = request.headers.get("Last-Event-ID") or request.args.get("since")
+    try:
+        last_id = int(since) if since is not None else events.last_id
+    except ValueError:
+        return jsonify({"error": "Invalid event id"}), 400
+
+    if request.args.get("mode") == "poll":
+        items = events.wait(last_id, timeout=STREAM_POLL_TIMEOUT)
+        return jsonify({
+            "last_id": items[-1][0] if items else last_id,
+            "events": [{"id": i, "event": e, "data": d} for i, e, d in items],
+        })
+
+    def generate(last_id):
+        yield f"retry: {STREAM_RETRY_MS}\n\n"
+        while True:
+            items = events.wait(last_id, timeout=STREAM_KEEPALIVE)
+            if not items:
+                yield ": keepalive\n\n"
+                continue
+            for item in items:
+                yield events.format_sse(item)
+            last_id = items[-1][0]
+
+    response = Response(stream_with_context(generate(last_id)), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
 
 @app.route("/api/cart", methods=["GET"])
 def get_cart():
-    return jsonify(scraper.store.load("cart"))
+    return snapshot_response("cart")
 
 @app.route("/api/cart", methods=["PUT"])
 def put_cart():
@@ -66,6 +143,103 @@ def save_settings():
     except:  # noqa: E722
         return jsonify({"code": "400", "msg": "Data Format Error!"}), 400
 
+@app.route("/api/profiles", methods=["GET"])
+def get_profiles():
+    """
+    Watch profiles, with the top-level settings filled in where a profile leaves them out.
+    """
+    return jsonify([
+        {key: value for key, value in profile.items() if key not in ("token", "tokens")}
+        for profile in scraper.store.profiles()
+    ])
+
+@app.route("/api/profiles/<profile_id>", methods=["PUT"])
+def save_profile(profile_id):
+    """
+    Add or replace a watch profile: {"name", "location", "equipment", "date_range", "nights"}.
+    Missing fields fall back to the top-level settings.
+    """
+    try:
+        data = request.get_json(force=True)
+    except Exception:
+        return jsonify({"error": "Invalid JSON"}), 400
+
+    profile = {"id": profile_id, "name": data.get("name") or profile_id}
+    for key, field in (("location", "location"), ("equipment", "equipment"), ("days", "date_range"), ("nights", "nights")):
+        if data.get(field) is not None:
+            profile[key] = data[field]
+    previous = scraper.store.profile(profile_id)
+    if previous is not None:
+        for key in ("token", "tokens"):
+            if previous.get(key):
+                profile[key] = previous[key]
+
+    scraper.save_profile(profile)
+    return jsonify({"code": 200, "msg": "Saved Success!"})
+
+@app.route("/api/profiles/<profile_id>", methods=["DELETE"])
+def delete_profile(profile_id):
+    if not scraper.delete_profile(profile_id):
+        return jsonify({"code": "404", "msg": "Unknown profile"}), 404
+    return jsonify({"code": "success"})
+
+@app.route("/api/runs", methods=["GET"])
+def get_runs():
+    """
+    Scheduler state: running job, next run per job and recent run history.
+    """
+    return jsonify(scraper.scheduler.status())
+
+@app.route("/api/runs", methods=["POST"])
+def run_now():
+    data = request.get_json(force=True, silent=True) or {}
+    if not scraper.scheduler.run_now(data.get("job")):
+        return jsonify({"code": "404", "msg": "Unknown job"}), 404
+    return jsonify({"code": "success"})
+
+@app.route("/api/runs/current", methods=["DELETE"])
+def cancel_run():
+    if not scraper.scheduler.cancel():
+        return jsonify({"code": "404", "msg": "Nothing is running"}), 404
+    return jsonify({"code": "success"})
+
+def time_arg(name):
+    """Timestamp of an ISO date/time query argument, None if absent."""
+    value = request.args.get(name)
+    if not value:
+        return None
+    return datetime.fromisoformat(value).timestamp()
+
+@app.route("/api/history/<park_id>", methods=["GET"])
+def get_park_history(park_id):
+    """
+    Free sites and nights of a park per run, with the nights opened and booked
+    since the previous run. Optional `?since=` / `?until=` ISO dates.
+    """
+    try:
+        since, until = time_arg("since"), time_arg("until")
+    except ValueError:
+        return jsonify({"error": "Invalid date"}), 400
+    return jsonify(scraper.history.park_summary(park_id, since, until))
+
+@app.route("/api/history/<park_id>/<int:resource_id>", methods=["GET"])
+def get_site_history(park_id, resource_id):
+    """
+    When nights of a site opened up or got booked. Optional `?since=` / `?until=` ISO dates.
+    """
+    try:
+        since, until = time_arg("since"), time_arg("until")
+    except ValueError:
+        return jsonify({"error": "Invalid date"}), 400
+    return jsonify(scraper.history.site_history(park_id, resource_id, since, until))
+
+@app.route("/api/metrics", methods=["GET"])
+def get_metrics():
+    """
+    Request, cache, database and crawl metrics in the Prometheus text format.
+    """
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route("/api/token", methods=["PUT"])
 def set_token():
     try:
@@ -75,7 +249,7 @@ def set_token():
 
     token = data.get("token", "Nothing")
 
-    scraper.set_fcm_token(token)
+    scraper.set_fcm_token(token, data.get("profile"))
 
     return jsonify({"code": "success"})
 
@@ -87,4 +261,4 @@ if __name__ == "__main__":
     scraper_thread = Thread(target=run_scraper, daemon=True)
     scraper_thread.start()
     # Start Flask app
-    app.run(host="0.0.0.0", port=5000)
+    app.run(host="0.0.0.0", port=5000, threaded=True)
@@ -0,0 +1,114 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+# Mode of published files; mkstemp creates them private (0600)
+FILE_MODE = 0o644
+
+
+class Snapshot(NamedTuple):
+    version: int
+    etag: str
+    body: bytes
+    gzip_body: bytes
+
+
+class SnapshotStore:
+    """
+    In-process copies of the JSON files under `root`, serialized once per publish.
+
+    Publishing writes the file atomically (temp file + rename), so readers of
+    the file never see a partial write, and bumps a version that keeps
+    increasing across restarts (it is seeded from the clock). Readers get the
+    ready-made body, its gzip encoding and an ETag derived from the content.
+    A file changed on disk by another process (or by hand) is read again.
+    """
+
+    def __init__(self, root: str = "store"):
+        self.root = root
+        self.snapshots: Dict[str, Snapshot] = {}
+        # (mtime, size, inode) of the file each snapshot was made from
+        self.stats: Dict[str, Tuple[int, int, int]] = {}
+        self.lock = threading.Lock()
+        self.version = int(time.time() * 1000)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.root, f"{name}.json")
+
+    def _stat(self, name: str) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.path(name))
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def _make(self, body: bytes) -> Snapshot:
+        with self.lock:
+            self.version += 1
+            version = self.version
+        return Snapshot(
+            version=version,
+            etag=hashlib.sha1(body).hexdigest()[:20],
+            body=body,
+            gzip_body=gzip.compress(body, compresslevel=6),
+        )
+
+    def publish(self, name: str, data: Any, indent: Optional[int] = None) -> Snapshot:
+        """Serialize `data`, write it atomically to disk and make it the current snapshot."""
+        if indent is None:
+            body = json.dumps(data, separators=(',', ':')).encode('utf-8')
+        else:
+            body = json.dumps(data, indent=indent).encode('utf-8')
+
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=f".{name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(body)
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.chmod(tmp, FILE_MODE)
+            os.replace(tmp, self.path(name))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        snapshot = self._make(body)
+        stat = self._stat(name)
+        with self.lock:
+            self.snapshots[name] = snapshot
+            self.stats[name] = stat
+        return snapshot
+
+    def get(self, name: str) -> Optional[Snapshot]:
+        """
+        Current snapshot of `name`, read from disk the first time and whenever the
+        file changed since. None if the file is missing.
+        """
+        stat = self._stat(name)
+        if stat is None:
+            return None
+        with self.lock:
+            snapshot = self.snapshots.get(name)
+            if snapshot is not None and self.stats.get(name) == stat:
+                return snapshot
+
+        try:
+            with open(self.path(name), "rb") as fp:
+                body = fp.read()
+        except OSError:
+            return None
+
+        snapshot = self._make(body)
+        with self.lock:
+            if self.stats.get(name) == self._stat(name) and name in self.snapshots:
+                # published while we were reading
+                return self.snapshots[name]
+            self.snapshots[name] = snapshot
+            self.stats[name] = stat
+        return snapshot
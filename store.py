@@ -1,18 +1,95 @@
 import os
+import re
+import time
 import sqlite3
 import json
+import threading
+from contextlib import contextmanager
 from typing import Any, List, Tuple, Optional, Dict
 
+from snapshot import Snapshot, SnapshotStore
+from metrics import DB_SECONDS
+
+# Applied to every new connection
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+    "PRAGMA foreign_keys=ON",
+)
+
 class DB:
-    def __init__(self, db_file: str):
+    """
+    SQLite helper keeping one long-lived connection per thread.
+    Each method commits on its own unless it runs inside `transaction()`;
+    errors are printed and return None, but raise inside a transaction.
+    """
+    def __init__(self, db_file: str, timeout: float = 30.0):
         self.db_file = db_file
+        self.timeout = timeout
+        self.local = threading.local()
 
     def _connect(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            return conn
         try:
-            return sqlite3.connect(self.db_file)
+            conn = sqlite3.connect(self.db_file, timeout=self.timeout, cached_statements=256)
+            # Use row_factory to get dict-like access
+            conn.row_factory = sqlite3.Row
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
         except sqlite3.Error as e:
             print(f"Error connecting to database: {e}")
             return None
+        self.local.conn = conn
+        self.local.depth = 0
+        return conn
+
+    def _in_transaction(self) -> bool:
+        return getattr(self.local, 'depth', 0) > 0
+
+    def _commit(self, conn):
+        if not self._in_transaction():
+            conn.commit()
+
+    def _rollback(self, conn):
+        if not self._in_transaction():
+            conn.rollback()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group several statements into one transaction, committed on exit and
+        rolled back on error. Nested blocks join the outermost transaction.
+
+            with db.transaction() as conn:
+                db.insert(...)
+                db.update_row(...)
+        """
+        conn = self._connect()
+        if conn is None:
+            raise sqlite3.OperationalError(f"Could not open database {self.db_file}")
+        self.local.depth += 1
+        try:
+            yield conn
+        except BaseException:
+            self.local.depth -= 1
+            if self.local.depth == 0:
+                conn.rollback()
+            raise
+        self.local.depth -= 1
+        if self.local.depth == 0:
+            conn.commit()
+
+    def close(self):
+        """Close the calling thread's connection."""
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+            self.local.depth = 0
 
     def execute(self, query: str, params: Tuple = (), commit: bool = False) -> Optional[sqlite3.Cursor]:
         """Execute a query with optional parameters. Commit if needed."""
@@ -20,16 +97,17 @@ class DB:
         if conn is None:
             return None
         try:
-            cursor = conn.cursor()
-            cursor.execute(query, params)
+            with DB_SECONDS.time(op='execute'):
+                cursor = conn.execute(query, params)
             if commit:
-                conn.commit()
+                self._commit(conn)
             return cursor
         except sqlite3.Error as e:
+            self._rollback(conn)
             print(f"Database query error: {e}\nQuery: {query}\nParams: {params}")
+            if self._in_transaction():
+                raise
             return None
-        finally:
-            conn.close()
 
     def create_table(self, create_table_sql: str) -> bool:
         """Create a table using the provided SQL statement."""
@@ -38,13 +116,11 @@ class DB:
             return False
         try:
             conn.execute(create_table_sql)
-            conn.commit()
+            self._commit(conn)
             return True
         except sqlite3.Error as e:
             print(f"Error creating table: {e}")
             return False
-        finally:
-            conn.close()
 
     def insert(self, table: str, data: Dict[str, Any]) -> Optional[int]:
         """Insert a row into table. Returns last row id or None on error."""
@@ -56,14 +132,75 @@ class DB:
         if conn is None:
             return None
         try:
-            cursor = conn.execute(query, values)
-            conn.commit()
+            with DB_SECONDS.time(op='insert'):
+                cursor = conn.execute(query, values)
+            self._commit(conn)
             return cursor.lastrowid
         except sqlite3.Error as e:
+            self._rollback(conn)
             print(f"Insert error: {e}\nQuery: {query}\nValues: {values}")
+            if self._in_transaction():
+                raise
+            return None
+
+    def insert_many(self, table: str, rows: List[Dict[str, Any]]) -> Optional[int]:
+        """Insert many rows sharing the same keys in one transaction. Returns rows inserted or None on error."""
+        if not rows:
+            return 0
+        keys = list(rows[0].keys())
+        placeholders = ', '.join(['?'] * len(keys))
+        query = f'INSERT INTO {table} ({", ".join(keys)}) VALUES ({placeholders})'
+        try:
+            with self.transaction() as conn:
+                with DB_SECONDS.time(op='insert_many'):
+                    cursor = conn.executemany(query, [tuple(row[k] for k in keys) for row in rows])
+                return cursor.rowcount
+        except sqlite3.Error as e:
+            print(f"Insert many error: {e}\nQuery: {query}")
+            if self._in_transaction():
+                raise
+            return None
+
+    def upsert_many(self, table: str, rows: List[Dict[str, Any]], conflict: str = 'id') -> Optional[int]:
+        """Insert many rows, updating the existing ones on `conflict`. Returns rows written or None on error."""
+        if not rows:
+            return 0
+        keys = list(rows[0].keys())
+        placeholders = ', '.join(['?'] * len(keys))
+        updates = ', '.join(f'{k}=excluded.{k}' for k in keys if k != conflict)
+        query = f'INSERT INTO {table} ({", ".join(keys)}) VALUES ({placeholders}) ON CONFLICT({conflict}) '
+        query += f'DO UPDATE SET {updates}' if updates else 'DO NOTHING'
+        try:
+            with self.transaction() as conn:
+                with DB_SECONDS.time(op='upsert_many'):
+                    cursor = conn.executemany(query, [tuple(row[k] for k in keys) for row in rows])
+                return cursor.rowcount
+        except sqlite3.Error as e:
+            print(f"Upsert many error: {e}\nQuery: {query}")
+            if self._in_transaction():
+                raise
+            return None
+
+    def update_many(self, table: str, updates: List[Tuple[Dict[str, Any], Tuple]], where: str) -> Optional[int]:
+        """
+        Apply many (data, params) updates sharing the same columns and where clause in one transaction.
+        Returns the total number of rows updated or None on error.
+        """
+        if not updates:
+            return 0
+        keys = list(updates[0][0].keys())
+        set_clause = ', '.join([f"{k}=?" for k in keys])
+        query = f'UPDATE {table} SET {set_clause} WHERE {where}'
+        try:
+            with self.transaction() as conn:
+                with DB_SECONDS.time(op='update_many'):
+                    cursor = conn.executemany(query, [tuple(data[k] for k in keys) + tuple(params) for data, params in updates])
+                return cursor.rowcount
+        except sqlite3.Error as e:
+            print(f"Update many error: {e}\nQuery: {query}")
+            if self._in_transaction():
+                raise
             return None
-        finally:
-            conn.close()
 
     def count(self, table: str, record_id):
         conn = self._connect()
@@ -71,10 +208,14 @@ class DB:
         if conn is None:
             return None
 
-        cursor = conn.cursor()
-        cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE id = ?", (record_id,))
-        count = cursor.fetchone()[0]  # Get the count from the result
-        return count > 0  # Return True if count is greater than 0
+        try:
+            with DB_SECONDS.time(op='count'):
+                cursor = conn.execute(f"SELECT COUNT(*) FROM {table} WHERE id = ?", (record_id,))
+                count = cursor.fetchone()[0]  # Get the count from the result
+            return count > 0  # Return True if count is greater than 0
+        except sqlite3.Error as e:
+            print(f"Count error: {e}\nTable: {table}\nId: {record_id}")
+            return None
 
     def fetch_one(self, table: str, where: str = '', params: Tuple = ()) -> Optional[Dict]:
         """Fetch single row matching where clause as a dict."""
@@ -86,18 +227,14 @@ class DB:
         if conn is None:
             return None
 
-        # Use row_factory to get dict-like access
-        conn.row_factory = sqlite3.Row
-
         try:
-            cursor = conn.execute(query, params)
-            row = cursor.fetchone()
+            with DB_SECONDS.time(op='fetch_one'):
+                cursor = conn.execute(query, params)
+                row = cursor.fetchone()
             return dict(row) if row else None
         except sqlite3.Error as e:
             print(f"Fetch one error: {e}\nQuery: {query}\nParams: {params}")
             return None
-        finally:
-            conn.close()
 
     def fetch_all(self, table: str, where: str = '', params: Tuple = ()) -> Optional[List[Dict]]:
         """Fetch all rows matching where clause as a list of dicts."""
@@ -108,18 +245,14 @@ class DB:
         if conn is None:
             return None
         
-        # Use row_factory to get dict-like access
-        conn.row_factory = sqlite3.Row
-        
         try:
-            cursor = conn.execute(query, params)
-            rows = cursor.fetchall()
+            with DB_SECONDS.time(op='fetch_all'):
+                cursor = conn.execute(query, params)
+                rows = cursor.fetchall()
             return [dict(row) for row in rows]
         except sqlite3.Error as e:
             print(f"Fetch all error: {e}\nQuery: {query}\nParams: {params}")
             return None
-        finally:
-            conn.close()
 
     def update_row(self, table: str, data: Dict[str, Any], where: str, params: Tuple) -> Optional[int]:
         """Update rows matching where clause. Returns number of rows updated or None on error."""
@@ -130,14 +263,16 @@ class DB:
         if conn is None:
             return None
         try:
-            cursor = conn.execute(query, values)
-            conn.commit()
+            with DB_SECONDS.time(op='update_row'):
+                cursor = conn.execute(query, values)
+            self._commit(conn)
             return cursor.rowcount
         except sqlite3.Error as e:
+            self._rollback(conn)
             print(f"Update error: {e}\nQuery: {query}\nValues: {values}")
+            if self._in_transaction():
+                raise
             return None
-        finally:
-            conn.close()
 
     def delete_row(self, table: str, where: str, params: Tuple) -> Optional[int]:
         """Delete rows matching where clause. Returns number of rows deleted or None on error."""
@@ -146,19 +281,55 @@ class DB:
         if conn is None:
             return None
         try:
-            cursor = conn.execute(query, params)
-            conn.commit()
+            with DB_SECONDS.time(op='delete_row'):
+                cursor = conn.execute(query, params)
+            self._commit(conn)
             return cursor.rowcount
         except sqlite3.Error as e:
+            self._rollback(conn)
             print(f"Delete error: {e}\nQuery: {query}\nParams: {params}")
+            if self._in_transaction():
+                raise
             return None
-        finally:
-            conn.close()
+
+# Tables mirrored in memory by Store.lookup, keyed by their integer id
+INDEXED_TABLES = ('resource_map', 'location', 'category')
+
+# Target table of a write statement
+WRITE_QUERY = re.compile(
+    r'\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+["`\[]?(\w+)',
+    re.IGNORECASE
+)
+
+# Maps the crawl never visits (Jasper Overflow), left out of the cached topology
+IGNORED_MAP_IDS = ('-2147483403',)
+
+# Hand-edited files keep their indentation, the others are written compact
+PRETTY_FILES = ('ini',)
+
+# Profile used when ini.json defines no `profiles`; its results keep the legacy file names
+DEFAULT_PROFILE = 'default'
+# Search settings a profile inherits from the top level of ini.json
+PROFILE_DEFAULTS = ('location', 'equipment', 'days', 'nights')
 
 class Store(DB):
     def __init__(self):
         super().__init__('store.db')
+        self.snapshots = SnapshotStore('store')
         self.data = self.load('ini')
+        # Guards read-modify-write changes of the settings, made from request threads and the notifier thread
+        self.data_lock = threading.RLock()
+
+        # Read-through in-memory index of INDEXED_TABLES
+        self.index = {}
+        self.index_lock = threading.Lock()
+
+        # Cached park -> section -> loop -> site map hierarchy
+        self.create_table('''CREATE TABLE IF NOT EXISTS map_tree (
+            map_id TEXT PRIMARY KEY,
+            children TEXT,
+            updated_at REAL NOT NULL
+        )''')
 
     def get(self, key = None):
         """
@@ -183,25 +354,125 @@ class Store(DB):
             self.data[key] = value
         
     def flush(self, file, data):
+        """
+        Atomically replace store/<file>.json and publish it as the new in-memory snapshot.
+        """
         try:
-            with open(f"store/{file}.json", "w", encoding="utf-8") as fp:
-                json.dump(data, fp, indent=4)
+            self.snapshots.publish(file, data, indent=4 if file in PRETTY_FILES else None)
         except Exception as e:
             print(e)
     
     def load(self, file):
+        """
+        Parse the current snapshot of store/<file>.json. Returns a fresh copy, safe to modify.
+        """
         data = None
         try:
-            with open(f"store/{file}.json", "r", encoding="utf-8") as fp:
-                data = json.load(fp)
+            data = json.loads(self.snapshots.get(file).body)
         except : #noqa : E722
             data = dict()
         return data
 
+    def snapshot(self, file) -> Optional[Snapshot]:
+        """
+        Serialized snapshot of store/<file>.json (body, gzip body, ETag, version).
+        """
+        return self.snapshots.get(file)
+
     def update(self, params : dict):
-        for key in params.keys():
-            self.data[key] = params[key]
-        self.flush('ini', self.data)
+        with self.data_lock:
+            for key in params.keys():
+                self.data[key] = params[key]
+            self.flush('ini', self.data)
+
+    def profiles(self) -> List[Dict]:
+        """
+        Watch profiles ({"id", "name", "location", "equipment", "days", "nights", "token", "tokens"}).
+        Without a `profiles` list, the top-level settings form the default profile.
+        """
+        defaults = {key: self.data.get(key) for key in PROFILE_DEFAULTS}
+        configured = self.data.get('profiles') or []
+        if not configured:
+            return [dict(defaults, id=DEFAULT_PROFILE, name='Default',
+                         token=self.data.get('token'), tokens=self.data.get('tokens') or [])]
+        return [{**defaults, 'token': None, **profile} for profile in configured]
+
+    @staticmethod
+    def push_tokens(profile: Dict) -> List[str]:
+        """Devices to alert for a profile: its `tokens` list plus the single `token`."""
+        tokens = list(profile.get('tokens') or [])
+        if profile.get('token'):
+            tokens.append(profile['token'])
+        return list(dict.fromkeys(tokens))
+
+    def add_token(self, token: str, profile_id=None):
+        """Register a device for the profile `profile_id`, or at the top level."""
+        with self.data_lock:
+            if profile_id is not None and self.data.get('profiles'):
+                profile = next((p for p in self.data['profiles'] if p['id'] == profile_id), None)
+                if profile is not None and token not in self.push_tokens(profile):
+                    self.save_profile(dict(profile, tokens=(profile.get('tokens') or []) + [token]))
+                return
+            if token not in self.push_tokens(self.data):
+                self.update({"tokens": (self.data.get('tokens') or []) + [token]})
+
+    def remove_token(self, token: str):
+        """Forget a device everywhere, e.g. after FCM reported it unregistered."""
+        with self.data_lock:
+            changes = {}
+            if token in self.push_tokens(self.data):
+                changes['tokens'] = [t for t in self.data.get('tokens') or [] if t != token]
+                if self.data.get('token') == token:
+                    changes['token'] = ""
+            profiles = self.data.get('profiles') or []
+            if any(token in self.push_tokens(profile) for profile in profiles):
+                changes['profiles'] = [
+                    dict(profile,
+                         tokens=[t for t in profile.get('tokens') or [] if t != token],
+                         token=None if profile.get('token') == token else profile.get('token'))
+                    for profile in profiles
+                ]
+            if changes:
+                self.update(changes)
+
+    def profile(self, profile_id=None) -> Optional[Dict]:
+        """Profile by id, the first profile if `profile_id` is None."""
+        profiles = self.profiles()
+        if profile_id is None:
+            return profiles[0]
+        return next((p for p in profiles if p['id'] == profile_id), None)
+
+    def all_parks(self) -> List[str]:
+        """Parks watched by at least one profile, in configuration order."""
+        parks = []
+        for profile in self.profiles():
+            for park_id in profile.get('location') or []:
+                if park_id not in parks:
+                    parks.append(park_id)
+        return parks
+
+    def save_profile(self, profile: Dict):
+        """Add or replace the profile with the same id."""
+        with self.data_lock:
+            profiles = [p for p in self.data.get('profiles') or [] if p['id'] != profile['id']]
+            profiles.append(profile)
+            self.update({"profiles": profiles})
+
+    def delete_profile(self, profile_id) -> bool:
+        with self.data_lock:
+            profiles = self.data.get('profiles') or []
+            remaining = [p for p in profiles if p['id'] != profile_id]
+            if len(remaining) == len(profiles):
+                return False
+            self.update({"profiles": remaining})
+            return True
+
+    @staticmethod
+    def result_file(kind: str, profile_id) -> str:
+        """File name of a profile's results, e.g. searchResult or searchResult.<profile id>."""
+        if profile_id is None or profile_id == DEFAULT_PROFILE:
+            return kind
+        return f"{kind}.{profile_id}"
 
     # return -> resource location id
     def find_location_id(self, map_id):
@@ -213,11 +484,144 @@ class Store(DB):
             return row['resource_location_id']
 
     def find_location(self, l_id):
-        return super().fetch_one('location', 'id = ?', (l_id,))
+        return self.lookup('location', l_id)
     
     def find_resource(self, r_id):
         return super().fetch_one('resource', 'id = ?', (r_id,))
 
+    def load_index(self, tables=INDEXED_TABLES):
+        """
+        (Re)load the in-memory index of `tables` from SQLite.
+        """
+        for table in tables:
+            rows = super().fetch_all(table) or []
+            index = {int(row['id']): row for row in rows}
+            with self.index_lock:
+                self.index[table] = index
+
+    def lookup(self, table: str, record_id) -> Optional[Dict]:
+        """
+        O(1) lookup of a row of an indexed table by id, loading the table on first use.
+        Returned rows are shared, do not modify them.
+        """
+        if table not in INDEXED_TABLES:
+            return super().fetch_one(table, 'id = ?', (record_id,))
+        with self.index_lock:
+            index = self.index.get(table)
+        if index is None:
+            self.load_index((table,))
+            with self.index_lock:
+                index = self.index[table]
+        try:
+            return index.get(int(record_id))
+        except (TypeError, ValueError):
+            return None
+
+    def invalidate(self, table: Optional[str] = None):
+        """
+        Drop the in-memory index of `table` (all tables if None) so the next lookup reloads it.
+        """
+        with self.index_lock:
+            if table is None:
+                self.index.clear()
+            else:
+                self.index.pop(table, None)
+
+    def _invalidate_query(self, query: str):
+        """
+        Drop the index of the table an INSERT, UPDATE, DELETE or REPLACE statement writes to.
+        """
+        match = WRITE_QUERY.match(query)
+        if match is not None and match.group(1).lower() in INDEXED_TABLES:
+            self.invalidate(match.group(1).lower())
+
+    def execute(self, query: str, params: Tuple = (), commit: bool = False) -> Optional[sqlite3.Cursor]:
+        cursor = super().execute(query, params, commit)
+        self._invalidate_query(query)
+        return cursor
+
+    def insert(self, table: str, data: Dict[str, Any]) -> Optional[int]:
+        result = super().insert(table, data)
+        self.invalidate(table)
+        return result
+
+    def insert_many(self, table: str, rows: List[Dict[str, Any]]) -> Optional[int]:
+        result = super().insert_many(table, rows)
+        self.invalidate(table)
+        return result
+
+    def upsert_many(self, table: str, rows: List[Dict[str, Any]], conflict: str = 'id') -> Optional[int]:
+        result = super().upsert_many(table, rows, conflict)
+        self.invalidate(table)
+        return result
+
+    def update_row(self, table: str, data: Dict[str, Any], where: str, params: Tuple) -> Optional[int]:
+        result = super().update_row(table, data, where, params)
+        self.invalidate(table)
+        return result
+
+    def update_many(self, table: str, updates: List[Tuple[Dict[str, Any], Tuple]], where: str) -> Optional[int]:
+        result = super().update_many(table, updates, where)
+        self.invalidate(table)
+        return result
+
+    def delete_row(self, table: str, where: str, params: Tuple) -> Optional[int]:
+        result = super().delete_row(table, where, params)
+        self.invalidate(table)
+        return result
+
+    def load_map_tree(self) -> Dict[str, Tuple[Optional[List[str]], float]]:
+        """
+        Load the cached map topology as {map_id: (child map ids or None for leaves, updated_at)}.
+        """
+        rows = super().fetch_all('map_tree') or []
+        return {
+            row['map_id']: (None if row['children'] is None else json.loads(row['children']), row['updated_at'])
+            for row in rows
+        }
+
+    def save_map_tree(self, nodes: Dict[str, Optional[List[str]]]) -> bool:
+        """
+        Store {map_id: child map ids or None for leaves} in the topology cache.
+        """
+        if not nodes:
+            return True
+        now = time.time()
+        rows = [
+            (str(map_id), None if children is None else json.dumps([str(c) for c in children if str(c) not in IGNORED_MAP_IDS]), now)
+            for map_id, children in nodes.items()
+        ]
+        try:
+            with self.transaction() as conn:
+                conn.executemany('INSERT OR REPLACE INTO map_tree (map_id, children, updated_at) VALUES (?, ?, ?)', rows)
+            return True
+        except sqlite3.Error as e:
+            print(f"Map tree save error: {e}")
+            return False
+
+    def map_leaves(self, park_id, tree: Optional[Dict] = None) -> Tuple[Optional[List[str]], Optional[float]]:
+        """
+        Resolve the leaf maps of a park from the topology cache, in crawl order.
+        Returns (leaf map ids, oldest updated_at), or (None, None) if the cached tree is incomplete.
+        """
+        if tree is None:
+            tree = self.load_map_tree()
+
+        leaves, oldest = [], None
+        stack = [str(park_id)]
+        while stack:
+            map_id = stack.pop()
+            if map_id not in tree:
+                return None, None
+            children, updated_at = tree[map_id]
+            oldest = updated_at if oldest is None else min(oldest, updated_at)
+            if children is None:
+                leaves.append(map_id)
+            else:
+                # trees cached before IGNORED_MAP_IDS was filtered out may still list them
+                stack.extend(child for child in reversed(children) if child not in IGNORED_MAP_IDS)
+        return leaves, oldest
+
 if __name__ == '__main__':
     
     db = DB('store.db')
@@ -0,0 +1,102 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, List
+
+
+class Tracer:
+    """
+    Records nested spans from any thread and exports them in the Chrome trace
+    event format, which chrome://tracing and ui.perfetto.dev open directly.
+
+        with tracer.span("map", map_id=map_id, depth=2) as span:
+            ...
+            span['outcome'] = "ok"
+
+    Values set on the yielded dict, or through `annotate` by code running inside
+    the span, end up in the span's args.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.events: List[Dict[str, Any]] = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self.threads: Dict[int, int] = {}
+
+    def _stack(self) -> list:
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def _tid(self) -> int:
+        ident = threading.get_ident()
+        with self.lock:
+            tid = self.threads.get(ident)
+            if tid is None:
+                tid = self.threads[ident] = len(self.threads) + 1
+                self.events.append({
+                    "name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid,
+                    "args": {"name": threading.current_thread().name},
+                })
+            return tid
+
+    def _now(self) -> float:
+        return (time.perf_counter() - self.origin) * 1e6
+
+    @contextmanager
+    def span(self, name: str, category: str = "crawl", **args):
+        stack = self._stack()
+        stack.append(args)
+        start = self._now()
+        try:
+            yield args
+        except BaseException as e:
+            args.setdefault('outcome', type(e).__name__)
+            raise
+        finally:
+            duration = self._now() - start
+            stack.pop()
+            event = {
+                "name": name, "cat": category, "ph": "X",
+                "ts": round(start, 1), "dur": round(duration, 1),
+                "pid": self.pid, "tid": self._tid(), "args": args,
+            }
+            with self.lock:
+                self.events.append(event)
+
+    def annotate(self, **args):
+        """Add args to the innermost open span of the calling thread, if any."""
+        stack = self._stack()
+        if stack:
+            stack[-1].update(args)
+
+    def export(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self.lock:
+            events = list(self.events)
+        with open(path, 'w', encoding='utf-8') as fp:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fp, separators=(',', ':'), default=str)
+
+
+class NullTracer:
+    """Tracer used when tracing is off; spans cost one small context manager."""
+
+    enabled = False
+
+    def span(self, name: str, category: str = "crawl", **args):
+        return nullcontext(args)
+
+    def annotate(self, **args):
+        pass
+
+
+NULL_TRACER = NullTracer()
@@ -0,0 +1,72 @@
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+# Daily availability code of a bookable night
+AVAILABLE = 0
+# Filler for missing days and malformed entries
+UNAVAILABLE = -1
+
+MaxNights = Union[None, int, Sequence[Optional[int]]]
+
+
+def _code(day_data) -> int:
+    """Availability code of one day, UNAVAILABLE if it is missing or not an integer (e.g. null)."""
+    code = day_data.get('availability') if isinstance(day_data, dict) else None
+    return code if isinstance(code, int) and not isinstance(code, bool) else UNAVAILABLE
+
+
+def pack(daily_lists: Sequence[Optional[list]], days: Optional[int] = None) -> np.ndarray:
+    """
+    Pack many `resourcedailyavailability` responses into a (resources x days) matrix
+    of availability codes. Short, missing or malformed responses are padded with UNAVAILABLE.
+    """
+    if days is None:
+        days = max((len(daily) for daily in daily_lists if daily), default=0)
+
+    matrix = np.full((len(daily_lists), days), UNAVAILABLE, dtype=np.int16)
+    for row, daily in enumerate(daily_lists):
+        if not daily:
+            continue
+        codes = [_code(day_data) for day_data in daily[:days]]
+        matrix[row, :len(codes)] = codes
+    return matrix
+
+
+def find_windows(matrix: np.ndarray, min_nights: int, max_nights: MaxNights = None) -> List[List[Tuple[int, int]]]:
+    """
+    Find every run of at least `min_nights` consecutive available nights, for all rows at once.
+    Args:
+        matrix: availability codes as returned by `pack`.
+        min_nights: shortest stay worth reporting.
+        max_nights: longest stay, either one value or one per row (None for no limit).
+            Longer runs are split into consecutive stays of `max_nights`.
+    Returns:
+        For each row, the list of (start_index, end_index) windows, end exclusive.
+    """
+    rows, days = matrix.shape
+    windows = [[] for _ in range(rows)]
+    if rows == 0 or days == 0:
+        return windows
+
+    min_nights = max(int(min_nights or 1), 1)
+    if max_nights is None or isinstance(max_nights, (int, np.integer)):
+        max_nights = [max_nights] * rows
+
+    # +1 where a run of free nights starts, -1 right after it ends
+    padded = np.zeros((rows, days + 2), dtype=np.int8)
+    padded[:, 1:-1] = matrix == AVAILABLE
+    edges = np.diff(padded, axis=1)
+    start_rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+
+    keep = (ends - starts) >= min_nights
+    for row, start, end in zip(start_rows[keep].tolist(), starts[keep].tolist(), ends[keep].tolist()):
+        limit = max_nights[row]
+        if not limit or limit < min_nights:
+            windows[row].append((start, end))
+            continue
+        while end - start >= min_nights:
+            windows[row].append((start, min(start + limit, end)))
+            start += limit
+    return windows
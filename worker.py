@@ -0,0 +1,112 @@
+"""
+Crawl worker of sharded runs.
+
+With the `shards` setting above 0, a run queues its parks (split into chunks
+of at most `shard_maps` root maps) on the work queue in store.db and starts
+that many local workers:
+
+    python worker.py --batch <id>
+
+Each worker has its own HTTP session and rate limit (`shard_rate`, or `rate`),
+crawls the maps of the items it claims, fetches the daily availability of the
+sites it finds and stores them as the item's result; the run merges the
+results into the usual searchResult. More hosts sharing the database can help
+with every run:
+
+    python worker.py --idle 3600
+"""
+import os
+import sys
+import time
+import signal
+import socket
+import argparse
+import threading
+import traceback
+
+from workqueue import WorkQueue
+
+# Seconds between two looks at an empty queue
+POLL_INTERVAL = 1.0
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def process(scraper, queue: WorkQueue, item, owner: str) -> bool:
+    """
+    Crawl one claimed item and store its result, renewing the lease meanwhile.
+    Returns True if the result was stored.
+    """
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(queue.lease / 3):
+            if not queue.extend(item['id'], owner):
+                print(f"Lost the lease of work item #{item['id']}")
+                return
+
+    thread = threading.Thread(target=heartbeat, name="lease", daemon=True)
+    thread.start()
+    try:
+        result = scraper.crawl_item(item['payload'])
+    except Exception as e:
+        traceback.print_exc()
+        queue.fail(item['id'], owner, f"{type(e).__name__}: {e}")
+        return False
+    finally:
+        stop.set()
+    return queue.complete(item['id'], owner, result)
+
+
+def serve(scraper, queue: WorkQueue, batch=None, idle=None) -> int:
+    """
+    Work items until the queue (or `batch`) has none left for `idle` seconds
+    (0 to return at once, None to wait forever). Returns the number of items done.
+    """
+    owner = worker_name()
+    done, idle_since = 0, time.time()
+    while True:
+        item = queue.claim(owner, batch)
+        if item is None:
+            if idle is not None and time.time() - idle_since >= idle:
+                return done
+            time.sleep(POLL_INTERVAL)
+            continue
+        if process(scraper, queue, item, owner):
+            done += 1
+        idle_since = time.time()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch', help='only work items of this batch, exit when it has none left')
+    parser.add_argument('--idle', type=float, default=None,
+                        help='exit after this many seconds without work (default: never, 0 with --batch)')
+    args = parser.parse_args()
+
+    # unwind on terminate, so checkpointed progress is saved
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+
+    from scraper import Scraper
+    from ratelimit import TokenBucket
+
+    scraper = Scraper()
+    scraper.limiter = TokenBucket(
+        rate=scraper.store.get('shard_rate') or scraper.store.get('rate') or 2,
+        burst=scraper.store.get('burst') or 4,
+    )
+    queue = WorkQueue(scraper.store, lease=scraper.store.get('shard_lease') or 300)
+    idle = args.idle if args.idle is not None else (0 if args.batch else None)
+
+    scraper._init_session_()
+    try:
+        done = serve(scraper, queue, args.batch, idle)
+    finally:
+        scraper._del_session_()
+    print(f"Worker {worker_name()} finished {done} items, {scraper.api_calls} API calls")
+
+
+if __name__ == '__main__':
+    main()
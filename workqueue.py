@@ -0,0 +1,146 @@
+import time
+import json
+import zlib
+import sqlite3
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from store import DB
+
+# States of a work item
+PENDING = "pending"
+CLAIMED = "claimed"
+DONE = "done"
+FAILED = "failed"
+
+
+class WorkQueue:
+    """
+    Durable work queue in the `work_queue` table, shared by every process (or
+    host) opening the same database.
+
+    Items are grouped in batches and handed out in insertion order. A worker
+    claims an item with a lease of `lease` seconds, renews it while it works
+    (`extend`) and stores a JSON result with `complete`. An item whose worker
+    died is handed out again once its lease expired; items failing or expiring
+    `max_attempts` times are marked failed.
+    """
+
+    def __init__(self, db: DB, lease: float = 300, max_attempts: int = 3):
+        self.db = db
+        self.lease = lease
+        self.max_attempts = max_attempts
+
+        self.db.create_table('''CREATE TABLE IF NOT EXISTS work_queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            batch TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            owner TEXT,
+            lease_until REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            result BLOB,
+            error TEXT,
+            created_at REAL NOT NULL,
+            finished_at REAL
+        )''')
+        self.db.create_table('CREATE INDEX IF NOT EXISTS work_queue_status ON work_queue (status, id)')
+        self.db.create_table('CREATE INDEX IF NOT EXISTS work_queue_batch ON work_queue (batch)')
+
+    def put(self, batch: str, payloads: Iterable[Dict[str, Any]]) -> Optional[int]:
+        """Queue one item per payload. Returns the number of items queued, None on error."""
+        now = time.time()
+        rows = [{"batch": batch, "payload": json.dumps(payload), "status": PENDING, "created_at": now}
+                for payload in payloads]
+        return self.db.insert_many('work_queue', rows) if rows else 0
+
+    def claim(self, owner: str, batch: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Lease the oldest pending (or abandoned) item, of `batch` if given.
+        Returns:
+            {"id", "batch", "payload", "attempts"}, or None if there is nothing to do.
+        """
+        now = time.time()
+        batch_filter, params = ('AND batch = ?', (batch,)) if batch is not None else ('', ())
+        try:
+            with self.db.transaction() as conn:
+                # abandoned too often, stop handing it out
+                conn.execute(
+                    f"UPDATE work_queue SET status = '{FAILED}', error = 'lease expired', finished_at = ? "
+                    f"WHERE status = '{CLAIMED}' AND lease_until < ? AND attempts >= ? {batch_filter}",
+                    (now, now, self.max_attempts) + params
+                )
+                row = conn.execute(
+                    f"UPDATE work_queue SET status = '{CLAIMED}', owner = ?, lease_until = ?, attempts = attempts + 1 "
+                    f"WHERE id = (SELECT id FROM work_queue WHERE (status = '{PENDING}' "
+                    f"OR (status = '{CLAIMED}' AND lease_until < ?)) {batch_filter} ORDER BY id LIMIT 1) "
+                    f"RETURNING id, batch, payload, attempts",
+                    (owner, now + self.lease, now) + params
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Work queue claim error: {e}")
+            return None
+        if row is None:
+            return None
+        return {"id": row['id'], "batch": row['batch'], "payload": json.loads(row['payload']), "attempts": row['attempts']}
+
+    def extend(self, item_id: int, owner: str) -> bool:
+        """Renew the lease of an item. Returns False if `owner` lost it."""
+        updated = self.db.update_row(
+            'work_queue', {"lease_until": time.time() + self.lease},
+            f"id = ? AND owner = ? AND status = '{CLAIMED}'", (item_id, owner)
+        )
+        return bool(updated)
+
+    def complete(self, item_id: int, owner: str, result: Any) -> bool:
+        """Store the result of an item. Returns False if `owner` no longer holds it."""
+        updated = self.db.update_row(
+            'work_queue',
+            {"status": DONE, "result": zlib.compress(json.dumps(result).encode('utf-8')), "finished_at": time.time()},
+            f"id = ? AND owner = ? AND status = '{CLAIMED}'", (item_id, owner)
+        )
+        return bool(updated)
+
+    def fail(self, item_id: int, owner: str, error: str) -> bool:
+        """Give an item back after an error: queued again, or failed after `max_attempts`."""
+        updated = self.db.execute(
+            f"UPDATE work_queue SET status = CASE WHEN attempts >= ? THEN '{FAILED}' ELSE '{PENDING}' END, "
+            f"error = ?, owner = NULL, lease_until = NULL, finished_at = ? "
+            f"WHERE id = ? AND owner = ? AND status = '{CLAIMED}'",
+            (self.max_attempts, error, time.time(), item_id, owner), commit=True
+        )
+        return updated is not None and updated.rowcount > 0
+
+    def progress(self, batch: str) -> Dict[str, int]:
+        """Number of items of a batch in each state."""
+        cursor = self.db.execute('SELECT status, COUNT(*) AS items FROM work_queue WHERE batch = ? GROUP BY status', (batch,))
+        counts = {PENDING: 0, CLAIMED: 0, DONE: 0, FAILED: 0}
+        for row in cursor or []:
+            counts[row['status']] = row['items']
+        return counts
+
+    def results(self, batch: str) -> List[Tuple[Dict[str, Any], Optional[Any]]]:
+        """(payload, result) of every item of a batch in queue order; the result is None unless done."""
+        rows = self.db.fetch_all('work_queue', 'batch = ? ORDER BY id', (batch,)) or []
+        return [
+            (json.loads(row['payload']),
+             json.loads(zlib.decompress(row['result'])) if row['status'] == DONE and row['result'] is not None else None)
+            for row in rows
+        ]
+
+    def cancel(self, batch: str) -> Optional[int]:
+        """Fail every unfinished item of a batch."""
+        return self.db.update_row(
+            'work_queue', {"status": FAILED, "error": "cancelled", "finished_at": time.time()},
+            f"batch = ? AND status IN ('{PENDING}', '{CLAIMED}')", (batch,)
+        )
+
+    def release(self, batch: str) -> Optional[int]:
+        """Put the unfinished items of a batch back in the queue, whoever holds them."""
+        return self.db.update_row(
+            'work_queue', {"status": PENDING, "owner": None, "lease_until": None},
+            f"batch = ? AND status IN ('{PENDING}', '{CLAIMED}')", (batch,)
+        )
+
+    def purge(self, batch: str) -> Optional[int]:
+        """Delete the items of a batch."""
+        return self.db.delete_row('work_queue', 'batch = ?', (batch,))